@@ -1,7 +1,10 @@
 
+import asyncio
 import logging
 import datetime as dt
 import os
+import time
+from typing import Optional
 
 from dotenv import load_dotenv
 from livekit.agents import (
@@ -9,17 +12,26 @@ from livekit.agents import (
     AgentSession,
     JobContext,
     JobProcess,
+    ChatContext,
+    ChatMessage,
     MetricsCollectedEvent,
     RoomInputOptions,
     WorkerOptions,
     cli,
     metrics,
 )
-from livekit.plugins import noise_cancellation, silero
+from livekit.plugins import noise_cancellation
 from livekit.plugins.turn_detector.multilingual import MultilingualModel
 from livekit.agents import function_tool, RunContext
 from google_calendar_tool import add_event, get_upcoming_events
-from google_mail_tool import send_email, list_unread_emails
+from google_mail_tool import (
+    get_email_attachment,
+    list_unread_emails,
+    read_email,
+    search_emails,
+)
+from mail_index import get_index
+from mail_outbox import get_outbox
 from google_tasks_tool import (
     list_task_lists,
     list_tasks,
@@ -27,7 +39,14 @@ from google_tasks_tool import (
     update_task,
     delete_task,
 )
-from datetime_tool import get_current_datetime
+from datetime_tool import describe_now, resolve_datetime, resolve_end
+from briefing import get_briefing
+import google_api
+from providers import ProviderSelector, load_profiles
+import tts_cache
+import worker_load
+import shared_models
+from tool_router import TOOL_GROUPS, ToolRouter, tool_names
 # from livekit.plugins import hedra
 
 # import uvicorn
@@ -46,7 +65,7 @@ load_dotenv(".env.local")
 language = os.getenv("PREFERRED_LANGUAGE")
 
 class Assistant(Agent):
-    def __init__(self) -> None:
+    def __init__(self, get_tts_cache=None) -> None:
         logger.info("Initializing Assistant agent")
         super().__init__(
             instructions=f"""
@@ -61,9 +80,80 @@ Your responses are concise, to the point, and without
 any complex formatting or punctuation including emojis,
 asterisks, or other symbols.
 You are curious, friendly, and have a sense of humor.
-Do not hesitate to use the appropriate tool to determine the curren date.
+The current date, time and timezone are given at the end of these instructions.
+Pass dates to tools as the user said them, in English,
+for example "tomorrow at 3pm" or "next Friday", they are resolved for you.
 """,
         )
+        # Only the tools the conversation needs are sent to the LLM
+        self._router = ToolRouter()
+        # Returns the audio cache of the voice currently speaking, if any
+        self._get_tts_cache = get_tts_cache
+        self._base_instructions = self.instructions
+        self._clock = None
+
+    def _routed_tools(self):
+        return [getattr(self, name) for name in tool_names(self._router.active)]
+
+    async def on_enter(self) -> None:
+        await self.update_tools(self._routed_tools())
+        self._clock = asyncio.create_task(self._keep_time())
+
+    async def on_exit(self) -> None:
+        if self._clock:
+            self._clock.cancel()
+
+    async def _keep_time(self):
+        # Give the current time in the instructions so dates need no tool call.
+        # They change once a minute, never during a turn, so the reply
+        # generated preemptively while the user speaks is still used
+        while True:
+            await self.update_instructions(f"{self._base_instructions}\n{describe_now()}")
+            await asyncio.sleep(60 - time.time() % 60)
+
+    async def on_user_turn_completed(
+        self, turn_ctx: ChatContext, new_message: ChatMessage
+    ) -> None:
+        # Google calls made while answering this turn share one latency budget
+        google_api.start_turn()
+        if self._router.next_turn(new_message.text_content or "") is not None:
+            logger.info(f"Loading tool groups {sorted(self._router.active)}")
+            await self.update_tools(self._routed_tools())
+
+    async def tts_node(self, text, model_settings):
+        # Repeated utterances are played from the audio cache, without the TTS
+        cache = self._get_tts_cache() if self._get_tts_cache else None
+        if cache is None:
+            async for frame in Agent.default.tts_node(self, text, model_settings):
+                yield frame
+            return
+
+        def synthesize(stream):
+            return Agent.default.tts_node(self, stream, model_settings)
+
+        async for frame in tts_cache.cached_tts_node(cache, text, synthesize):
+            yield frame
+
+# TOOLS ########################################################################
+
+    @function_tool
+    async def enable_tools(self, context: RunContext, group: str):
+        """Use this tool to load the tools you need when they are missing.
+
+        Args:
+            group: One of "calendar", "mail", "tasks" or "utility" (weather).
+        """
+        logger.info(f"Enabling tool group {group}")
+        try:
+            self._router.enable(group)
+        except ValueError as error:
+            return f"{error}, use one of {', '.join(TOOL_GROUPS)}."
+        await self.update_tools(self._routed_tools())
+        # The reply to a tool output is generated with the tools of the
+        # current turn, so answer from a new reply that has the new ones
+        self.session.generate_reply(
+            instructions=f"The {group} tools are now available, use them to continue with the user's request."
+        )
 
 # SAMPLE TOOL ##################################################################
 
@@ -81,13 +171,16 @@ Do not hesitate to use the appropriate tool to determine the curren date.
 
         return "sunny with a temperature of 70 degrees."
 
-# DATE #########################################################################
+# BRIEFING #####################################################################
 
     @function_tool
-    async def get_current_datetime(self, context: RunContext):
-        """Returns the current date and time in ISO format."""
-        logger.info("Getting current date and time")
-        return get_current_datetime()
+    async def get_daily_briefing(self, context: RunContext):
+        """Use this tool when the user asks what their day looks like.
+
+        Returns their next calendar events, unread emails and open tasks at once.
+        """
+        logger.info("Preparing daily briefing")
+        return await get_briefing()
 
 # GOOGLE CALENDAR ##############################################################
 
@@ -97,21 +190,29 @@ Do not hesitate to use the appropriate tool to determine the curren date.
         context: RunContext,
         summary: str,
         description: str,
-        start_time: dt.datetime,
-        end_time: dt.datetime,
-        timezone: str = 'Europe/Paris'
+        start_time: str,
+        end_time: Optional[str] = None,
+        duration_minutes: int = 60,
     ):
         """Use this tool to schedule an event in Google Calendar.
 
         Args:
             summary: The summary or title of the event.
             description: The description of the event.
-            start_time: The start time of the event in 'YYYY-MM-DDTHH:MM:SS' format.
-            end_time: The end time of the event in 'YYYY-MM-DDTHH:MM:SS' format.
-            timezone: The timezone for the event (default is 'Europe/Paris').
+            start_time: When the event starts, in English (e.g. "tomorrow at 3pm", "next Friday at noon") or 'YYYY-MM-DDTHH:MM:SS' format.
+            end_time: When the event ends, in the same formats (optional).
+            duration_minutes: The duration of the event when end_time is not given (default is 60).
         """
-        logger.info(f"Scheduling Google Calendar event: {summary} from {start_time} to {end_time}")
-        return add_event(summary, description, start_time, end_time)
+        try:
+            start = resolve_datetime(start_time)
+            if end_time:
+                end = resolve_end(end_time, start)
+            else:
+                end = start + dt.timedelta(minutes=duration_minutes)
+        except ValueError as error:
+            return f"{error}. Ask the user to say the date differently."
+        logger.info(f"Scheduling Google Calendar event: {summary} from {start} to {end}")
+        return add_event(summary, description, start, end)
 
     @function_tool
     async def get_next_scheduled_google_calendar_events(self, context: RunContext, count: int = 2):
@@ -134,8 +235,11 @@ Do not hesitate to use the appropriate tool to determine the curren date.
             subject: The subject of the email.
             message: The content of the email.
         """
-        logger.info(f"Sending email to {to} with subject {subject}")
-        return send_email(to, subject, message)
+        logger.info(f"Queueing email to {to} with subject {subject}")
+        _, duplicate = get_outbox().enqueue(to, subject, message)
+        if duplicate:
+            return f"This email to {to} was already sent or queued."
+        return f"Email to {to} queued, you will be told once it is delivered."
 
     @function_tool
     async def list_google_unread_emails(self, context: RunContext, count: int = 5):
@@ -147,6 +251,38 @@ Do not hesitate to use the appropriate tool to determine the curren date.
         logger.info(f"Listing last {count} unread emails")
         return list_unread_emails(count)
 
+    @function_tool
+    async def search_google_emails(self, context: RunContext, query: str, count: int = 5):
+        """Use this tool to find emails by sender, subject or content.
+
+        Args:
+            query: Keywords to look for, such as a sender name or a topic (e.g. "alice invoice").
+            count: The number of emails to retrieve (default is 5).
+        """
+        logger.info(f"Searching emails for {query}")
+        return search_emails(query, count)
+
+    @function_tool
+    async def read_google_email(self, context: RunContext, message_id: str):
+        """Use this tool to read the content of an email to the user.
+
+        Args:
+            message_id: The ID of the email, as given by search_google_emails or list_google_unread_emails.
+        """
+        logger.info(f"Reading email {message_id}")
+        return read_email(message_id)
+
+    @function_tool
+    async def read_google_email_attachment(self, context: RunContext, message_id: str, attachment: str):
+        """Use this tool to read a text attachment of an email to the user.
+
+        Args:
+            message_id: The ID of the email, as given by search_google_emails or list_google_unread_emails.
+            attachment: The file name of the attachment, as listed by read_google_email.
+        """
+        logger.info(f"Reading attachment {attachment} of email {message_id}")
+        return get_email_attachment(message_id, attachment)
+
 # GOOGLE TASKS #################################################################
 
     @function_tool
@@ -156,37 +292,81 @@ Do not hesitate to use the appropriate tool to determine the curren date.
         return list_task_lists()
 
     @function_tool
-    async def list_google_tasks(self, context: RunContext, task_list_id: str):
-        """Use this tool to list the tasks in a specific Google Task list."""
-        logger.info(f"Listing tasks for task list {task_list_id}")
-        return list_tasks(task_list_id)
+    async def list_google_tasks(self, context: RunContext, task_list: str):
+        """Use this tool to list the tasks in a specific Google Task list.
+
+        Args:
+            task_list: The name or the id of the task list.
+        """
+        logger.info(f"Listing tasks for task list {task_list}")
+        return list_tasks(task_list)
 
     @function_tool
     async def create_google_task(
-        self, context: RunContext, task_list_id: str, title: str, notes: str = None
+        self,
+        context: RunContext,
+        title: str,
+        notes: Optional[str] = None,
+        task_list: Optional[str] = None,
     ):
-        """Use this tool to create a new task in a specific Google Task list."""
-        logger.info(f"Creating task '{title}' in task list {task_list_id}")
-        return create_task(task_list_id, title, notes)
+        """Use this tool to create a new task in a Google Task list.
+
+        Args:
+            title: The title of the task.
+            notes: Optional notes for the task.
+            task_list: The name or the id of the task list (default list if omitted).
+        """
+        logger.info(f"Creating task '{title}' in task list {task_list}")
+        return create_task(task_list, title, notes)
 
     @function_tool
     async def update_google_task(
-        self, context: RunContext, task_list_id: str, task_id: str, title: str, notes: str = None
+        self,
+        context: RunContext,
+        task: str,
+        title: Optional[str] = None,
+        notes: Optional[str] = None,
+        completed: Optional[bool] = None,
+        task_list: Optional[str] = None,
     ):
-        """Use this tool to update a task in a specific Google Task list."""
-        logger.info(f"Updating task {task_id} in task list {task_list_id}")
-        return update_task(task_list_id, task_id, title, notes)
+        """Use this tool to rename a task, change its notes or mark it as done or not done.
+
+        Args:
+            task: The name or the id of the task (e.g. "buy milk").
+            title: The new title, if it changes.
+            notes: The new notes, if they change.
+            completed: True to mark the task as done, False to reopen it.
+            task_list: The name or the id of the task list (all lists are searched if omitted).
+        """
+        logger.info(f"Updating task {task} in task list {task_list}")
+        return update_task(task_list, task, title, notes, completed)
 
     @function_tool
-    async def delete_google_task(self, context: RunContext, task_list_id: str, task_id: str):
-        """Use this tool to delete a task in a specific Google Task list."""
-        logger.info(f"Deleting task {task_id} from task list {task_list_id}")
-        return delete_task(task_list_id, task_id)
+    async def delete_google_task(
+        self, context: RunContext, task: str, task_list: Optional[str] = None
+    ):
+        """Use this tool to delete a task from Google Tasks.
+
+        Args:
+            task: The name or the id of the task (e.g. "buy milk").
+            task_list: The name or the id of the task list (all lists are searched if omitted).
+        """
+        logger.info(f"Deleting task {task} from task list {task_list}")
+        return delete_task(task_list, task)
 
 #
 
 def prewarm(proc: JobProcess):
-    proc.userdata["vad"] = silero.VAD.load()
+    started = time.monotonic()
+    before = shared_models.memory_usage()
+    # Built once in the forkserver and shared by all processes (see shared_models.py)
+    proc.userdata["vad"] = shared_models.vad()
+    # Synthesize the configured phrases (see tts_cache.py) for the preferred voice
+    tts_cache.prewarm(load_profiles()["tts"][0], language)
+    # The worker sizes its pool of warm processes from this (see worker_load.py)
+    after = shared_models.memory_usage()
+    logger.info(f"Memory before prewarm: {before}, after: {after}")
+    worker_load.report(prewarm=time.monotonic() - started, uss=after.get("uss"))
 
 #
 
@@ -207,20 +387,15 @@ async def entrypoint(ctx: JobContext):
         "room": ctx.room.name,
     }
 
-    # Set up a voice AI pipeline using OpenAI, Cartesia, AssemblyAI, and the LiveKit turn detector
+    # Set up a voice AI pipeline, picking the fastest healthy STT, LLM and TTS
+    # from the profiles configured in providers.json (see providers.py)
+    # See all available models at https://docs.livekit.io/agents/models/
+    providers = ProviderSelector()
     session = AgentSession(
         # Speech-to-text (STT) is your agent's ears, turning the user's speech into text that the LLM can understand
-        # See all available models at https://docs.livekit.io/agents/models/stt/
-        stt="assemblyai/universal-streaming:en",
-        # stt="cartesia/ink-whisper:fr",
-        # stt="deepgram/nova-3:fr",
         # A Large Language Model (LLM) is your agent's brain, processing user input and generating a response
-        # See all available models at https://docs.livekit.io/agents/models/llm/
-        llm="openai/gpt-4.1-mini",
         # Text-to-speech (TTS) is your agent's voice, turning the LLM's text into speech that the user can hear
-        # See all available models as well as voice selections at https://docs.livekit.io/agents/models/tts/
-        tts="cartesia/sonic-2:a167e0f3-df7e-4d52-a9c3-f949145efdab",
-        # cartesia/sonic-2:9626c31c-bec5-4cca-baa8-f8ba9e84c8bc",
+        **providers.build(vad=ctx.proc.userdata["vad"]),
         # VAD and turn detection are used to determine when the user is speaking and when the agent should respond
         # See more at https://docs.livekit.io/agents/build/turns
         turn_detection=MultilingualModel(),
@@ -229,6 +404,14 @@ async def entrypoint(ctx: JobContext):
         # See more at https://docs.livekit.io/agents/build/audio/#preemptive-generation
         preemptive_generation=True,
     )
+    # One audio cache per voice, so a TTS failover never plays another voice
+    tts_caches = {}
+
+    def get_tts_cache():
+        model = providers.active.get("tts")
+        if model and model not in tts_caches:
+            tts_caches[model] = tts_cache.TTSCache(model, language)
+        return tts_caches.get(model)
 
     # To use a realtime model instead of a voice pipeline, use the following session setup instead.
     # (Note: This is for the OpenAI Realtime API. For other providers, see https://docs.livekit.io/agents/models/realtime/))
@@ -248,6 +431,7 @@ async def entrypoint(ctx: JobContext):
     def _on_metrics_collected(ev: MetricsCollectedEvent):
         metrics.log_metrics(ev.metrics)
         usage_collector.collect(ev.metrics)
+        providers.collect(ev.metrics)
 
     async def log_usage():
         summary = usage_collector.get_summary()
@@ -255,6 +439,54 @@ async def entrypoint(ctx: JobContext):
 
     ctx.add_shutdown_callback(log_usage)
 
+    async def save_provider_stats():
+        await asyncio.to_thread(providers.stats.save)
+
+    ctx.add_shutdown_callback(save_provider_stats)
+
+    # Emails are delivered in the background, report the outcome once known
+    loop = asyncio.get_running_loop()
+    outbox = get_outbox(ctx.job.id)
+
+    def _report_mail_status(entry: dict):
+        if entry["status"] == "sent":
+            instructions = f"Briefly tell the user the email to {entry['to']} about {entry['subject']} was sent."
+        elif entry["status"] == "unknown":
+            instructions = (
+                f"Tell the user it is not certain whether the email to {entry['to']} about {entry['subject']}"
+                " was sent, and that they should check their Sent folder before asking to send it again."
+            )
+        else:
+            instructions = f"Tell the user the email to {entry['to']} about {entry['subject']} could not be sent: {entry['error']}"
+        session.generate_reply(instructions=instructions)
+
+    outbox.on_status(
+        lambda entry: loop.call_soon_threadsafe(_report_mail_status, entry)
+    )
+    outbox.start()
+
+    # Keep the local mail index fresh so email searches never wait for Gmail
+    mail_index = get_index()
+    mail_index.start()
+
+    async def stop_mail_index():
+        mail_index.stop()
+
+    ctx.add_shutdown_callback(stop_mail_index)
+
+    async def stop_outbox():
+        await asyncio.to_thread(outbox.stop, 5)
+
+    ctx.add_shutdown_callback(stop_outbox)
+
+    # Report how late this job's event loop runs, the worker admits rooms on it
+    lag_monitor = asyncio.create_task(worker_load.monitor_event_loop())
+
+    async def stop_lag_monitor():
+        lag_monitor.cancel()
+
+    ctx.add_shutdown_callback(stop_lag_monitor)
+
     # # Add a virtual avatar to the session, if desired
     # # For other providers, see https://docs.livekit.io/agents/models/avatar/
     # avatar = hedra.AvatarSession(
@@ -265,7 +497,7 @@ async def entrypoint(ctx: JobContext):
 
     # Start the session, which initializes the voice pipeline and warms up the models
     await session.start(
-        agent=Assistant(),
+        agent=Assistant(get_tts_cache=get_tts_cache),
         room=ctx.room,
         room_input_options=RoomInputOptions(
             # For telephony applications, use `BVCTelephony` for best results
@@ -303,4 +535,11 @@ if __name__ == "__main__":
     # threading.Thread(target=start_dummy_server, daemon=True).start()
 
     # run agent
-    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
+    cli.run_app(WorkerOptions(
+        entrypoint_fnc=entrypoint,
+        prewarm_fnc=prewarm,
+        # Admit rooms on sessions, CPU, event-loop lag and memory, not CPU alone
+        load_fnc=worker_load.WorkerLoad(),
+        # In production, keep enough warm processes for the bursts seen recently
+        **worker_load.worker_options(),
+    ))
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import os
+
+from google_calendar_tool import get_upcoming_events
+from google_mail_tool import list_unread_emails
+from google_tasks_tool import list_open_tasks
+
+logger = logging.getLogger("briefing")
+
+# Seconds the briefing waits for its sources before answering with what it has.
+BRIEFING_BUDGET = float(os.getenv("BRIEFING_BUDGET", "4"))
+
+
+def _compact_emails(emails: str) -> str:
+    if not emails:
+        return "No unread emails."
+    # Labels are noise when read out loud.
+    lines = [line for line in emails.splitlines() if not line.startswith("Labels:")]
+    return "Unread emails:\n" + "\n".join(lines)
+
+
+async def get_briefing(
+    budget: float = BRIEFING_BUDGET, events: int = 3, emails: int = 3, tasks: int = 5
+) -> str:
+    """
+    Summarizes upcoming events, unread emails and open tasks.
+
+    The three sources are queried concurrently. Whatever has not answered
+    after `budget` seconds is left out and reported as unavailable.
+
+    Args:
+        budget: The number of seconds to wait for the sources.
+        events: The number of upcoming events to include.
+        emails: The number of unread emails to include.
+        tasks: The number of open tasks to include.
+    """
+    sources = {
+        "calendar": asyncio.ensure_future(asyncio.to_thread(get_upcoming_events, events)),
+        "emails": asyncio.ensure_future(asyncio.to_thread(list_unread_emails, emails)),
+        "tasks": asyncio.ensure_future(asyncio.to_thread(list_open_tasks, tasks)),
+    }
+    await asyncio.wait(sources.values(), timeout=budget)
+
+    sections = []
+    for name, future in sources.items():
+        if not future.done():
+            logger.warning(f"Briefing: {name} did not answer within {budget}s")
+            sections.append(f"The {name} could not be checked in time.")
+            continue
+        try:
+            result = future.result()
+        except Exception as e:
+            sections.append(f"The {name} could not be checked: {e}")
+            continue
+        if name == "calendar":
+            sections.append(result or "No upcoming events.")
+        elif name == "emails":
+            sections.append(_compact_emails(result))
+        else:
+            sections.append(result)
+    return "\n\n".join(section.strip() for section in sections)
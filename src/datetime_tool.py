@@ -1,5 +1,212 @@
 import datetime
+import re
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from google_calendar_tool import TIMEZONE
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = [
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december",
+]
+NUMBERS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11,
+    "twelve": 12, "fifteen": 15, "twenty": 20, "thirty": 30, "forty five": 45,
+}
+UNITS = {"minute": "minutes", "hour": "hours", "day": "days", "week": "weeks"}
+# Time of day used when only a day, or a part of the day, is given.
+PARTS_OF_DAY = {
+    "morning": (9, 0),
+    "noon": (12, 0),
+    "midday": (12, 0),
+    "afternoon": (15, 0),
+    "evening": (19, 0),
+    "tonight": (20, 0),
+    "night": (21, 0),
+    "midnight": (0, 0),
+}
+DEFAULT_TIME = (9, 0)
+
+_MONTH = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+_NUMBER = r"\d+|" + "|".join(sorted(NUMBERS, key=len, reverse=True))
+_TIME = r"\b(\d{1,2})(?:[:h](\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?(?=\W)"
+
 
 def get_current_datetime():
-    """Returns the current date and time."""
-    return datetime.datetime.now().isoformat()
+    """Returns the current date and time in TIMEZONE."""
+    return now().isoformat()
+
+
+def now() -> datetime.datetime:
+    """Returns the current tz-aware date and time in TIMEZONE."""
+    return datetime.datetime.now(ZoneInfo(TIMEZONE))
+
+
+def describe_now(current: Optional[datetime.datetime] = None) -> str:
+    """Returns the current date, time and timezone as a sentence for the LLM."""
+    current = current or now()
+    return (
+        f"Current date and time: {current:%A %Y-%m-%d %H:%M} "
+        f"({TIMEZONE}, UTC{current:%z})."
+    )
+
+
+def resolve_datetime(
+    expression: str, current: Optional[datetime.datetime] = None
+) -> datetime.datetime:
+    """
+    Resolves an ISO or relative English date expression to a tz-aware datetime.
+
+    Understands for instance "tomorrow at 3", "in two hours", "next Friday",
+    "monday morning", "march 3 at 15:30" or "2025-03-03T15:30:00". A time
+    without am/pm between 1 and 7 is taken as afternoon. A bare time already
+    past today means tomorrow.
+
+    Args:
+        expression: The date expression to resolve.
+        current: The reference date and time (default is now in TIMEZONE).
+
+    Raises:
+        ValueError: If the expression cannot be understood.
+    """
+    return _resolve(expression, current or now())[0]
+
+
+def resolve_end(
+    expression: str,
+    start: datetime.datetime,
+    current: Optional[datetime.datetime] = None,
+) -> datetime.datetime:
+    """
+    Resolves the end of an event starting at `start`.
+
+    The expression is resolved from now like any date, so "friday at 5pm"
+    ends on the same Friday as "friday at 3pm"; a bare time such as "4:30pm"
+    is taken on the day of the start.
+
+    Args:
+        expression: The date expression to resolve.
+        start: The start of the event.
+        current: The reference date and time (default is now in TIMEZONE).
+
+    Raises:
+        ValueError: If the expression cannot be understood or is not after the start.
+    """
+    end, day_found = _resolve(expression, current or now())
+    if not day_found:
+        end = datetime.datetime.combine(start.date(), end.timetz())
+    if end <= start:
+        raise ValueError(f"The end '{expression}' is not after the start {start:%A %Y-%m-%d %H:%M}")
+    return end
+
+
+def _resolve(expression: str, current: datetime.datetime):
+    """Returns the datetime of an expression and whether it named a day."""
+    tz = current.tzinfo or ZoneInfo(TIMEZONE)
+    text = expression.strip()
+
+    try:
+        parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    else:
+        return (parsed if parsed.tzinfo else parsed.replace(tzinfo=tz)), True
+
+    text = " " + re.sub(r"[,!?]", " ", text.lower()) + " "
+    if re.search(r"\bnow\b", text):
+        return current.replace(microsecond=0), True
+
+    match = re.search(rf"\bin\s+({_NUMBER}|half an)\s+(minute|hour|day|week)s?\b", text)
+    if match:
+        amount = match[1]
+        amount = 0.5 if amount == "half an" else NUMBERS.get(amount) or int(amount)
+        delta = datetime.timedelta(**{UNITS[match[2]]: amount})
+        return (current + delta).replace(second=0, microsecond=0), True
+
+    day, text, day_found = _resolve_day(text, current.date())
+    time_of_day, time_found = _resolve_time(text)
+    if not day_found and not time_found:
+        raise ValueError(f"Cannot understand the date '{expression}'")
+
+    hour, minute = time_of_day or DEFAULT_TIME
+    resolved = datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=tz)
+    if not day_found and resolved <= current:
+        resolved += datetime.timedelta(days=1)
+    return resolved, day_found
+
+
+def _resolve_day(text: str, today: datetime.date):
+    """Returns the day named in the text, the text without it, and whether one was found."""
+    relative = [
+        (r"\b(the\s+)?day\s+after\s+tomorrow\b", 2),
+        (r"\btomorrow\b", 1),
+        (r"\byesterday\b", -1),
+        (r"\b(today|tonight)\b", 0),
+    ]
+    for pattern, days in relative:
+        match = re.search(pattern, text)
+        if match:
+            # Keep "tonight" in the text, it also gives the time of day.
+            if match[0] != "tonight":
+                text = text[: match.start()] + text[match.end() :]
+            return today + datetime.timedelta(days=days), text, True
+
+    match = re.search(r"\b(next|this|on)?\s*(" + "|".join(WEEKDAYS) + r")\b", text)
+    if match:
+        ahead = (WEEKDAYS.index(match[2]) - today.weekday()) % 7
+        if ahead == 0 and match[1] != "this":
+            ahead = 7
+        text = text[: match.start()] + text[match.end() :]
+        return today + datetime.timedelta(days=ahead), text, True
+
+    match = re.search(r"\bnext\s+week\b", text)
+    if match:
+        text = text[: match.start()] + text[match.end() :]
+        return today + datetime.timedelta(days=7 - today.weekday()), text, True
+
+    for pattern, day_group, month_group in (
+        (rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?{_MONTH}(?:\s+(\d{{4}}))?", 1, 2),
+        (rf"\b{_MONTH}\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:\s+(\d{{4}}))?", 2, 1),
+    ):
+        match = re.search(pattern, text)
+        if match:
+            month = next(i for i, name in enumerate(MONTHS, 1) if name.startswith(match[month_group][:3]))
+            year = int(match[3]) if match[3] else today.year
+            day = datetime.date(year, month, int(match[day_group]))
+            if not match[3] and day < today:
+                day = day.replace(year=year + 1)
+            text = text[: match.start()] + text[match.end() :]
+            return day, text, True
+
+    return today, text, False
+
+
+def _resolve_time(text: str):
+    """Returns the (hour, minute) named in the text, if any, and whether one was found."""
+    for match in re.finditer(_TIME, text):
+        # A bare number is only a time when introduced by "at".
+        if match[2] or match[3] or re.search(r"\bat\s*$", text[: match.start()]):
+            break
+    else:
+        match = None
+    if match:
+        hour, minute = int(match[1]), int(match[2] or 0)
+        suffix = (match[3] or "").replace(".", "")
+        if suffix == "pm" and hour < 12:
+            hour += 12
+        elif suffix == "am" and hour == 12:
+            hour = 0
+        elif not suffix and 1 <= hour <= 7:
+            hour += 12
+        if re.search(r"\b(evening|tonight|night|afternoon)\b", text) and hour < 12:
+            hour += 12
+        if hour > 23 or minute > 59:
+            raise ValueError(f"Invalid time '{match[0].strip()}'")
+        return (hour, minute), True
+
+    for part, time_of_day in PARTS_OF_DAY.items():
+        if re.search(rf"\b{part}\b", text):
+            return time_of_day, True
+    return None, False
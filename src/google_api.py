@@ -0,0 +1,351 @@
+import concurrent.futures
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.errors import HttpError
+
+from google_cassette import get_cassette
+from google_quota import INTERACTIVE, scheduler
+
+logger = logging.getLogger("google_api")
+
+# Total time a single tool call may spend on one Google request, retries included.
+DEFAULT_DEADLINE = float(os.getenv("GOOGLE_API_DEADLINE", "6"))
+# Time budget shared by every Google request made while answering one user turn.
+TURN_BUDGET = float(os.getenv("GOOGLE_API_TURN_BUDGET", "10"))
+# An idempotent read still pending after this delay gets a duplicate request.
+HEDGE_AFTER = float(os.getenv("GOOGLE_API_HEDGE_AFTER", "1.5"))
+# Account the quota scheduler charges requests to.
+GOOGLE_USER = os.getenv("GOOGLE_USER", "me")
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 2.0
+RETRIABLE_STATUSES = {429, 500, 502, 503, 504}
+CACHE_SIZE = 256
+
+
+class GoogleApiUnavailableError(Exception):
+    """
+    Raised when a request misses its deadline or its API circuit is open.
+
+    `maybe_sent` is True when a request may have reached Google before
+    failing, so a write may have been applied.
+    """
+
+    def __init__(self, reason: str, maybe_sent: bool = False):
+        super().__init__(reason)
+        self.maybe_sent = maybe_sent
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of one Google API.
+
+    After `failure_threshold` failures the circuit opens and requests are
+    short-circuited for `reset_timeout` seconds. A single trial request is
+    then let through (half-open): success closes the circuit, failure opens
+    it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """Returns True if a request may be sent now."""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """Ends a trial request that neither succeeded nor failed, e.g. held by quota."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=16, thread_name_prefix="google-api"
+)
+_local = threading.local()
+_turn_deadline = None
+
+
+def get_breaker(api: str) -> CircuitBreaker:
+    """Returns the circuit breaker of the given API, creating it if needed."""
+    with _breakers_lock:
+        if api not in _breakers:
+            _breakers[api] = CircuitBreaker()
+        return _breakers[api]
+
+
+def start_turn(budget: float = TURN_BUDGET):
+    """
+    Starts the latency budget of a new user turn.
+
+    Every request executed until the next call shares this budget, so a turn
+    that chains several Google calls still answers in bounded time.
+
+    Args:
+        budget: The number of seconds available for the turn.
+    """
+    global _turn_deadline
+    _turn_deadline = time.monotonic() + budget
+
+
+def execute(
+    request,
+    api: str,
+    idempotent: bool = True,
+    cache_key: Optional[str] = None,
+    deadline: Optional[float] = None,
+    priority: int = INTERACTIVE,
+    user: str = GOOGLE_USER,
+):
+    """
+    Executes a googleapiclient request with a deadline, retries and a circuit breaker.
+
+    Every attempt first waits for a token from the per-user quota scheduler.
+    Idempotent requests are retried with jittered exponential backoff and
+    hedged: if no answer arrived after HEDGE_AFTER seconds, a duplicate is
+    sent and the first response wins. Non-idempotent requests are only
+    retried when Google rejected them for rate limiting, since any other failure may
+    have been applied. Successful reads with a `cache_key` are cached and
+    served instead when the API's circuit is open or the request fails.
+
+    Args:
+        request: The HttpRequest returned by a googleapiclient method.
+        api: The API name ("gmail", "calendar", "tasks"), used for the breaker.
+        idempotent: Whether the request may safely be sent more than once.
+        cache_key: Key under which to cache the response, for reads.
+        deadline: Seconds allowed for this call (default is DEFAULT_DEADLINE).
+        priority: google_quota.INTERACTIVE or google_quota.BACKGROUND.
+        user: The account the request is charged to for quota purposes.
+    """
+    now = time.monotonic()
+    deadline_at = now + (deadline if deadline is not None else DEFAULT_DEADLINE)
+    if priority == INTERACTIVE and _turn_deadline is not None and _turn_deadline > now:
+        deadline_at = min(deadline_at, _turn_deadline)
+
+    breaker = get_breaker(api)
+    if not breaker.allow():
+        return _cached_or_raise(api, cache_key, f"{api} circuit is open")
+
+    last_error = None
+    # Waiting for our own quota says nothing about the health of the API.
+    quota_exhausted = False
+    # Whether an attempt failed in a way that does not tell if Google applied it.
+    maybe_sent = False
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            break
+        if not scheduler.acquire(user, api, priority, timeout=remaining):
+            last_error = TimeoutError(f"{api} quota exhausted")
+            quota_exhausted = True
+            break
+        remaining = deadline_at - time.monotonic()
+        retry_after = None
+        try:
+            result = _attempt(
+                request,
+                remaining,
+                HEDGE_AFTER if idempotent else None,
+                # A hedge is only sent if the quota has a token for it right now.
+                lambda: scheduler.acquire(user, api, priority, timeout=0),
+            )
+        except HttpError as error:
+            last_error = error
+            status = error.resp.status
+            if is_rate_limited(error):
+                retry_after = _retry_after(error)
+                scheduler.throttle(user, api, retry_after)
+            elif status not in RETRIABLE_STATUSES:
+                # The request itself is wrong, the API is healthy.
+                breaker.record_success()
+                raise
+            elif not idempotent:
+                break
+        except (concurrent.futures.TimeoutError, OSError, httplib2.HttpLib2Error) as error:
+            last_error = error
+            # A refused connection or an unknown host means nothing was sent.
+            if not isinstance(error, (ConnectionRefusedError, httplib2.ServerNotFoundError)):
+                maybe_sent = True
+            if not idempotent:
+                break
+        else:
+            breaker.record_success()
+            scheduler.record_success(user, api)
+            if cache_key is not None:
+                _cache_put((api, cache_key), result)
+            return result
+
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+        if retry_after is not None:
+            # The scheduler holds the next attempt until Retry-After has passed.
+            delay = 0
+        if attempt == MAX_ATTEMPTS or time.monotonic() + delay >= deadline_at:
+            break
+        logger.info(f"Retrying {api} request in {delay:.2f}s after: {last_error}")
+        time.sleep(delay)
+
+    if last_error is None or quota_exhausted or is_rate_limited(last_error):
+        breaker.release()
+    else:
+        breaker.record_failure()
+    if isinstance(last_error, HttpError) and _cache_get((api, cache_key)) is None:
+        raise last_error
+    return _cached_or_raise(
+        api,
+        cache_key,
+        f"{api} request did not complete in time: {last_error!r}",
+        maybe_sent,
+    )
+
+
+def is_rate_limited(error) -> bool:
+    """Returns True for 429s and the 403s Google uses for exhausted quotas."""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    content = error.content or b""
+    return error.resp.status == 403 and (
+        b"rateLimitExceeded" in content or b"userRateLimitExceeded" in content
+    )
+
+
+def _retry_after(error: HttpError) -> float:
+    """Returns the Retry-After delay of a response in seconds, if any."""
+    value = error.resp.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def _attempt(
+    request, timeout: float, hedge_after: Optional[float] = None, hedge_token=None
+):
+    """
+    Runs one (possibly hedged) attempt, waiting at most `timeout` seconds.
+
+    `hedge_token` is called before sending the duplicate request, which is
+    skipped if it returns False.
+    """
+    started = time.monotonic()
+    futures = [_executor.submit(_run, request, timeout)]
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = concurrent.futures.wait(futures, timeout=hedge_after)
+        if not done and (hedge_token is None or hedge_token()):
+            logger.info("Hedging slow Google API request")
+            futures.append(_executor.submit(_run, request, timeout - hedge_after))
+
+    error = None
+    remaining = timeout - (time.monotonic() - started)
+    for future in concurrent.futures.as_completed(futures, timeout=max(remaining, 0)):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
+
+
+def _run(request, timeout: float):
+    """Executes the request, through the recording cassette if one is configured."""
+    cassette = get_cassette()
+    if cassette is not None:
+        return cassette.run(request, timeout, _send)
+    return _send(request, timeout)
+
+
+def _send(request, timeout: float):
+    """Executes the request on this thread's own connection with a socket timeout."""
+    credentials = getattr(request.http, "credentials", None)
+    if credentials is None:
+        return request.execute()
+    # httplib2 connections are not thread-safe, so every executor thread
+    # keeps its own authorized connection instead of sharing request.http.
+    http = getattr(_local, "http", None)
+    if http is None or http.credentials is not credentials:
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        _local.http = http
+    http.http.timeout = timeout
+    return request.execute(http=http)
+
+
+def _cache_get(key):
+    with _cache_lock:
+        return _cache.get(key)
+
+
+def _cache_put(key, value):
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _cached_or_raise(api: str, cache_key: str, reason: str, maybe_sent: bool = False):
+    cached = _cache_get((api, cache_key)) if cache_key is not None else None
+    if cached is None:
+        raise GoogleApiUnavailableError(reason, maybe_sent)
+    logger.warning(f"Serving cached {api} data ({cache_key}): {reason}")
+    return cached
@@ -6,6 +6,7 @@ import os.path
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from google_api import GoogleApiUnavailableError, execute
 from google_auth import authenticate_google
 
 TIMEZONE = "Europe/Paris"
@@ -65,10 +66,11 @@ def add_event(
             },
         }
 
-        created = service.events().insert(
-            calendarId='primary',
-            body=event_body
-        ).execute()
+        created = execute(
+            service.events().insert(calendarId='primary', body=event_body),
+            "calendar",
+            idempotent=False,
+        )
         return created
 
     except HttpError as error:
@@ -87,17 +89,17 @@ def get_upcoming_events(count: int):
         # Appelle l'API Calendar
         now = datetime.datetime.utcnow().isoformat() + "Z" # 'Z' indique UTC
         print("Récupération des prochains événements")
-        events_result = (
-            service.events()
-               .list(
-                   calendarId="primary",
-                   timeMin=now,
-                   maxResults=10,
-                   singleEvents=True,
-                   orderBy="startTime",
-               )
-               .execute()
-           )
+        events_result = execute(
+            service.events().list(
+                calendarId="primary",
+                timeMin=now,
+                maxResults=10,
+                singleEvents=True,
+                orderBy="startTime",
+            ),
+            "calendar",
+            cache_key="upcoming",
+        )
         events = events_result.get("items", [])
         if not events:
             print("Aucun événement à venir trouvé.")
@@ -110,6 +112,8 @@ def get_upcoming_events(count: int):
         return ret
     except HttpError as error:
         return(f"Une erreur s'est produite : {error}")
+    except GoogleApiUnavailableError as error:
+        return(f"Google Agenda ne répond pas : {error}")
 
 if __name__ == "__main__":
     # Exemple d'utilisation
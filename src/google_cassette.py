@@ -0,0 +1,254 @@
+import atexit
+import base64
+import binascii
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger("google_cassette")
+
+# "record" saves every Google API exchange to the cassette, "replay" answers
+# requests from it without any network access. Unset, requests go to Google.
+GOOGLE_CASSETTE_MODE = os.getenv("GOOGLE_CASSETTE_MODE")
+GOOGLE_CASSETTE_PATH = os.getenv("GOOGLE_CASSETTE_PATH", "google_cassette.json")
+# Factor applied to the recorded latencies on replay, 0 to answer at once.
+GOOGLE_CASSETTE_LATENCY = float(os.getenv("GOOGLE_CASSETTE_LATENCY", "1.0"))
+
+# Headers whose whole value identifies people, not just their addresses.
+PEOPLE_HEADERS = {"from", "to", "cc", "bcc", "reply-to", "delivered-to", "return-path", "sender"}
+# Fields and query parameters holding opaque tokens.
+TOKEN_FIELDS = {"nextPageToken", "nextSyncToken", "pageToken", "syncToken", "etag", "iCalUID", "htmlLink"}
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# Message, thread, event, task and list ids: long tokens mixing letters and digits.
+_ID = re.compile(r"\b(?=[\w-]*\d)(?=[\w-]*[A-Za-z])[\w-]{16,}\b")
+_DATETIME = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:\d{2})?")
+
+
+class CassetteMissError(Exception):
+    """Raised on replay when no recorded exchange matches a request."""
+
+
+class Sanitizer:
+    """
+    Replaces addresses, ids and tokens with placeholders.
+
+    The same value always gets the same placeholder, so ids returned by one
+    response and sent back in a later request still match on replay.
+    """
+
+    def __init__(self):
+        self._emails = {}
+        self._ids = {}
+        self._tokens = {}
+
+    def _placeholder(self, mapping: dict, value: str, template: str) -> str:
+        if value not in mapping:
+            mapping[value] = template.format(len(mapping) + 1)
+        return mapping[value]
+
+    def text(self, value: str) -> str:
+        value = _EMAIL.sub(
+            lambda m: self._placeholder(self._emails, m[0].lower(), "person{}@example.invalid"), value
+        )
+        return _ID.sub(lambda m: self._placeholder(self._ids, m[0], "anon{:012d}"), value)
+
+    def token(self, value: str) -> str:
+        return self._placeholder(self._tokens, value, "token{}")
+
+    def data(self, value, key: Optional[str] = None):
+        if isinstance(value, dict):
+            if isinstance(value.get("name"), str) and value["name"].lower() in PEOPLE_HEADERS:
+                people = [self.text(email) for email in _EMAIL.findall(value.get("value", ""))]
+                return {**value, "value": ", ".join(people) or "person"}
+            return {k: self.data(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.data(v, key) for v in value]
+        if isinstance(value, str):
+            if key in TOKEN_FIELDS:
+                return self.token(value)
+            if key == "raw":
+                return self.text(_decode_raw(value))
+            return self.text(value)
+        return value
+
+    def uri(self, uri: str) -> str:
+        parts = urlsplit(uri)
+        query = [
+            (name, self.token(value) if name in TOKEN_FIELDS else self.text(value))
+            for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        ]
+        return _join(self.text(unquote(parts.path)), query)
+
+
+def _join(path: str, query: list) -> str:
+    # Left unquoted, so dates and addresses in the query stay readable
+    return path + ("?" + "&".join(f"{name}={value}" for name, value in query) if query else "")
+
+
+def _decode_raw(value: str) -> str:
+    # Gmail sends messages as base64url MIME, decoded so addresses can be replaced.
+    try:
+        return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode("utf-8", "replace")
+    except (binascii.Error, ValueError):
+        return value
+
+
+class _Identity:
+    """Stands in for the Sanitizer on replay, where requests are already sanitized."""
+
+    def uri(self, uri: str) -> str:
+        parts = urlsplit(uri)
+        return _join(unquote(parts.path), parse_qsl(parts.query, keep_blank_values=True))
+
+    def data(self, value, key: Optional[str] = None):
+        if isinstance(value, dict):
+            return {k: self.data(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.data(v, key) for v in value]
+        if isinstance(value, str) and key == "raw":
+            return _decode_raw(value)
+        return value
+
+
+def _request_key(request, sanitizer) -> str:
+    """Returns what identifies a request, with dates blanked so replays do not depend on the clock."""
+    body = request.body
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    if body:
+        with contextlib.suppress(ValueError):
+            body = json.dumps(sanitizer.data(json.loads(body)), sort_keys=True)
+    key = f"{request.method} {sanitizer.uri(request.uri)} {body or ''}"
+    return _DATETIME.sub("<datetime>", key)
+
+
+class Cassette:
+    """
+    Google API exchanges recorded with their latency.
+
+    In "record" mode requests go to Google and every response, HTTP error
+    or connection failure is kept with the time it took, sanitized, and
+    written to `path` on save. In "replay" mode requests are answered from the recording after waiting
+    the recorded latency times `latency_scale`; a request still waiting when
+    its timeout expires raises TimeoutError, as a slow connection would.
+    Identical requests are answered in the order they were recorded, the
+    last answer being repeated once they are used up.
+    """
+
+    def __init__(self, path: str, mode: str, latency_scale: float = GOOGLE_CASSETTE_LATENCY):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}'")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.interactions = []
+        self._sanitizer = Sanitizer() if mode == "record" else _Identity()
+        self._lock = threading.Lock()
+        self._cursors = {}
+        if mode == "replay":
+            with open(path) as f:
+                self.interactions = json.load(f)["interactions"]
+
+    def run(self, request, timeout: float, send):
+        """
+        Executes a request through the cassette.
+
+        Args:
+            request: The googleapiclient HttpRequest.
+            timeout: Seconds the request may take.
+            send: Function sending the request for real, called as send(request, timeout).
+        """
+        if self.mode == "replay":
+            return self._replay(request, timeout)
+        return self._record(request, timeout, send)
+
+    def _record(self, request, timeout: float, send):
+        started = time.monotonic()
+        interaction = {"request": _request_key(request, self._sanitizer)}
+        try:
+            result = send(request, timeout)
+        except HttpError as error:
+            interaction["error"] = {
+                "status": error.resp.status,
+                "retry-after": error.resp.get("retry-after"),
+                "content": self._sanitizer.text((error.content or b"").decode("utf-8", "replace")),
+            }
+            raise
+        except (TimeoutError, OSError, httplib2.HttpLib2Error) as error:
+            interaction["failure"] = self._sanitizer.text(repr(error))
+            raise
+        else:
+            interaction["response"] = self._sanitizer.data(result)
+            return result
+        finally:
+            interaction["latency"] = round(time.monotonic() - started, 4)
+            with self._lock:
+                self.interactions.append(interaction)
+
+    def _replay(self, request, timeout: float):
+        key = _request_key(request, self._sanitizer)
+        with self._lock:
+            matches = [i for i in self.interactions if i["request"] == key]
+            if not matches:
+                raise CassetteMissError(f"No recorded response for {key}")
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+        interaction = matches[min(cursor, len(matches) - 1)]
+
+        latency = interaction.get("latency", 0) * self.latency_scale
+        if latency > timeout:
+            time.sleep(max(timeout, 0))
+            raise TimeoutError(f"Replayed request timed out after {timeout:.2f}s")
+        time.sleep(latency)
+
+        if "failure" in interaction:
+            raise ConnectionError(f"Replayed failure: {interaction['failure']}")
+        error = interaction.get("error")
+        if error:
+            headers = {"status": error["status"]}
+            if error.get("retry-after"):
+                headers["retry-after"] = error["retry-after"]
+            raise HttpError(httplib2.Response(headers), error["content"].encode(), uri=request.uri)
+        return interaction["response"]
+
+    def save(self):
+        """Writes the recorded exchanges to the cassette file."""
+        if self.mode != "record":
+            return
+        with self._lock:
+            data = {"version": 1, "interactions": list(self.interactions)}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.path)
+        logger.info(f"Saved {len(data['interactions'])} Google API exchanges to {self.path}")
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette():
+    """Returns the cassette configured by GOOGLE_CASSETTE_MODE, or None."""
+    global _cassette
+    if not GOOGLE_CASSETTE_MODE:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(GOOGLE_CASSETTE_PATH, GOOGLE_CASSETTE_MODE)
+            atexit.register(_cassette.save)
+        return _cassette
+
+
+def replaying() -> bool:
+    return GOOGLE_CASSETTE_MODE == "replay"
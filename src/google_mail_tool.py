@@ -1,45 +1,77 @@
 
 import base64
+import codecs
+import re
+from email.message import Message
 from email.mime.text import MIMEText
+from html.parser import HTMLParser
 
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from google_api import execute
 from google_auth import authenticate_google
+from google_quota import INTERACTIVE
+from mail_index import get_index
 
+# Characters of an email body read to the user at most.
+MAX_BODY_CHARS = 2000
+# Decoded bytes of a body or attachment processed at most.
+MAX_READ_BYTES = 64 * 1024
+# Parts larger than this are not downloaded at all.
+MAX_FETCH_BYTES = 2 * 1024 * 1024
+# Nesting of MIME parts explored (mixed > alternative > related > html).
+MAX_PART_DEPTH = 4
+# Base64 characters decoded at a time, a multiple of 4.
+DECODE_CHUNK = 16 * 1024
 
-def send_email(to: str, subject: str, message_text: str):
+
+def _part_fields(fields: str, depth: int = MAX_PART_DEPTH) -> str:
+    return fields if depth == 0 else f"{fields},parts({_part_fields(fields, depth - 1)})"
+
+
+# The structure of a message without any content.
+STRUCTURE_FIELDS = f"id,payload({_part_fields('partId,mimeType,filename,headers,body(size,attachmentId)')})"
+
+
+def data_fields(part_id: str) -> str:
     """
-    Sends an email using Gmail.
+    Returns the fields selecting the inline content of the parts at the depth of a part.
+
+    Partial responses cannot pick one element of a list, but they can stop
+    at one nesting level: only the part and its siblings are downloaded,
+    e.g. the text/plain part and its text/html alternative.
+    """
+    depth = part_id.count(".") + 1 if part_id else 0
+    return f"payload({'parts(' * depth}partId,body/data{')' * depth})"
+
+
+def deliver_email(
+    service, to: str, subject: str, message_text: str, priority: int = INTERACTIVE
+):
+    """
+    Sends an email with an authenticated Gmail service, raising on failure.
 
     Args:
+        service: The Gmail service returned by googleapiclient's build.
         to: The recipient's email address.
         subject: The subject of the email.
         message_text: The body of the email.
+        priority: google_quota.INTERACTIVE or google_quota.BACKGROUND.
     """
-    creds = authenticate_google()
-    if not creds:
-        return "Authentication failed. Please ensure credentials.json is set up correctly."
-
-    try:
-        service = build("gmail", "v1", credentials=creds)
-
-        message = MIMEText(message_text)
-        message["to"] = to
-        message["subject"] = subject
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    message = MIMEText(message_text)
+    message["to"] = to
+    message["subject"] = subject
+    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
 
-        create_message = {"raw": raw_message}
-        # pylint: disable=E1101
-        send_message = (
-            service.users().messages().send(userId="me", body=create_message).execute()
-        )
-        return send_message
-
-    except HttpError as error:
-        return f"An error occurred: {error}"
-    except Exception as e:
-        return f"An unexpected error occurred: {e}"
+    create_message = {"raw": raw_message}
+    # pylint: disable=E1101
+    return execute(
+        service.users().messages().send(userId="me", body=create_message),
+        "gmail",
+        idempotent=False,
+        priority=priority,
+    )
 
 
 def list_unread_emails(n: int):
@@ -57,21 +89,25 @@ def list_unread_emails(n: int):
         service = build("gmail", "v1", credentials=creds)
 
         # pylint: disable=E1101
-        messages = (
-            service.users()
-            .messages()
-            .list(userId="me", q="is:unread", maxResults=n)
-            .execute()
+        messages = execute(
+            service.users().messages().list(userId="me", q="is:unread", maxResults=n),
+            "gmail",
+            cache_key=f"unread:{n}",
         )
 
         email_list = []
         if "messages" in messages:
             for message in messages["messages"]:
-                msg = (
-                    service.users()
-                    .messages()
-                    .get(userId="me", id=message["id"])
-                    .execute()
+                # Headers only, so no email content is kept in the response cache
+                msg = execute(
+                    service.users().messages().get(
+                        userId="me",
+                        id=message["id"],
+                        format="metadata",
+                        metadataHeaders=["From", "Subject"],
+                    ),
+                    "gmail",
+                    cache_key=f"metadata:{message['id']}",
                 )
                 headers = msg["payload"]["headers"]
                 subject = next(
@@ -82,7 +118,7 @@ def list_unread_emails(n: int):
                 )
                 labels = msg["labelIds"]
                 email_list.append(
-                    f"From: {sender}\nSubject: {subject}\nLabels: {labels}"
+                    f"ID: {message['id']}\nFrom: {sender}\nSubject: {subject}\nLabels: {labels}"
                 )
         return "\n---\n".join(email_list)
 
@@ -90,3 +126,359 @@ def list_unread_emails(n: int):
         return f"An error occurred: {error}"
     except Exception as e:
         return f"An unexpected error occurred: {e}"
+
+
+def search_emails(query: str, n: int = 5):
+    """
+    Searches the local mail index for emails matching the query.
+
+    While the index is still being built, or when it has no match (it only
+    holds the most recent emails), Gmail is searched instead.
+
+    Args:
+        query: Keywords such as a sender name or a topic.
+        n: The maximum number of emails to return.
+    """
+    index = get_index()
+    if not index.ready():
+        return _search_gmail(query, n)
+    results = index.search(query, n)
+    if not results:
+        return _search_gmail(query, n)
+    return "\n---\n".join(
+        f"ID: {r['id']}\nFrom: {r['sender']}\nSubject: {r['subject']}\nSnippet: {r['snippet']}"
+        for r in results
+    )
+
+
+def _search_gmail(query: str, n: int):
+    creds = authenticate_google()
+    if not creds:
+        return "Authentication failed. Please ensure credentials.json is set up correctly."
+
+    try:
+        service = build("gmail", "v1", credentials=creds)
+
+        # pylint: disable=E1101
+        messages = execute(
+            service.users().messages().list(userId="me", q=query, maxResults=n),
+            "gmail",
+            cache_key=f"search:{n}:{query}",
+        ).get("messages", [])
+        if not messages:
+            return f"No email found matching '{query}'."
+
+        email_list = []
+        for message in messages:
+            msg = execute(
+                service.users().messages().get(
+                    userId="me",
+                    id=message["id"],
+                    format="metadata",
+                    metadataHeaders=["From", "Subject"],
+                ),
+                "gmail",
+                cache_key=f"metadata:{message['id']}",
+            )
+            headers = msg.get("payload", {}).get("headers", [])
+            sender = next((h["value"] for h in headers if h["name"] == "From"), None)
+            subject = next((h["value"] for h in headers if h["name"] == "Subject"), None)
+            email_list.append(
+                f"ID: {msg['id']}\nFrom: {sender}\nSubject: {subject}\nSnippet: {msg.get('snippet', '')}"
+            )
+        return "\n---\n".join(email_list)
+
+    except HttpError as error:
+        return f"An error occurred: {error}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+
+class _SpeakableText(HTMLParser):
+    """Collects the text of an HTML document, skipping scripts and styles."""
+
+    SKIPPED = frozenset({"script", "style", "head", "title"})
+    BLOCKS = frozenset(
+        {"p", "br", "div", "li", "tr", "table", "blockquote"}
+        | {"h1", "h2", "h3", "h4", "h5", "h6"}
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._skipping = 0
+        self._chunks = []
+        self.length = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self._skipping += 1
+        elif tag in self.BLOCKS:
+            self._add("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED:
+            self._skipping = max(self._skipping - 1, 0)
+        elif tag in self.BLOCKS:
+            self._add("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._add(data)
+
+    def _add(self, text):
+        self._chunks.append(text)
+        self.length += len(text)
+
+    def text(self):
+        return "".join(self._chunks)
+
+
+class _PlainText:
+    def __init__(self):
+        self._chunks = []
+        self.length = 0
+
+    def feed(self, text):
+        self._chunks.append(text)
+        self.length += len(text)
+
+    def close(self):
+        pass
+
+    def text(self):
+        return "".join(self._chunks)
+
+
+def _speakable(text: str) -> str:
+    text = re.sub(r"https?://\S+", "(link)", text)
+    lines = (re.sub(r"[ \t\xa0]+", " ", line).strip() for line in text.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _charset(part) -> str:
+    header = next(
+        (h["value"] for h in part.get("headers", []) if h["name"].lower() == "content-type"), ""
+    )
+    message = Message()
+    message["Content-Type"] = header or part.get("mimeType", "text/plain")
+    charset = message.get_content_charset() or "utf-8"
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = "utf-8"
+    return charset
+
+
+def decode_body(data: str, charset: str, html: bool, max_chars: int, max_bytes: int = MAX_READ_BYTES):
+    """
+    Decodes base64url MIME content into speakable text, a chunk at a time.
+
+    Stops as soon as `max_bytes` decoded bytes were read or `max_chars`
+    characters of text were produced, so the size of the content does not
+    matter.
+
+    Returns:
+        A (text, truncated) tuple.
+    """
+    decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    sink = _SpeakableText() if html else _PlainText()
+    read, truncated = 0, False
+    for start in range(0, len(data), DECODE_CHUNK):
+        chunk = data[start : start + DECODE_CHUNK]
+        raw = base64.urlsafe_b64decode(chunk + "=" * (-len(chunk) % 4))
+        if read + len(raw) > max_bytes:
+            raw, truncated = raw[: max_bytes - read], True
+        read += len(raw)
+        last = truncated or start + DECODE_CHUNK >= len(data)
+        sink.feed(decoder.decode(raw, final=last))
+        if not last and sink.length > max_chars:
+            truncated = True
+        if truncated:
+            break
+    sink.close()
+    text = _speakable(sink.text())
+    if len(text) > max_chars:
+        text, truncated = text[:max_chars].rsplit(" ", 1)[0], True
+    return text, truncated
+
+
+def _walk(part):
+    yield part
+    for child in part.get("parts", []):
+        yield from _walk(child)
+
+
+def _header(part, name: str):
+    return next((h["value"] for h in part.get("headers", []) if h["name"].lower() == name), None)
+
+
+def _fetch_size(payload, part) -> int:
+    """
+    Returns the bytes downloaded to read a part.
+
+    A part with an attachment id is downloaded alone; the others come with
+    every inline part at their depth (see data_fields).
+    """
+    body = part.get("body", {})
+    if body.get("attachmentId"):
+        return body.get("size", 0)
+    depth = part.get("partId", "").count(".") + 1 if part.get("partId") else 0
+
+    def inline(node, level):
+        if level == depth:
+            node_body = node.get("body", {})
+            return 0 if node_body.get("attachmentId") else node_body.get("size", 0)
+        return sum(inline(child, level + 1) for child in node.get("parts", []))
+
+    return inline(payload, 0)
+
+
+def _part_data(service, message_id: str, part):
+    """Downloads the base64url content of a single part of a message."""
+    body = part.get("body", {})
+    if body.get("attachmentId"):
+        attachment = execute(
+            service.users().messages().attachments().get(
+                userId="me", messageId=message_id, id=body["attachmentId"]
+            ),
+            "gmail",
+        )
+        return attachment.get("data", "")
+    # Parts without an attachment id are only served inline with the message.
+    part_id = part.get("partId", "")
+    message = execute(
+        service.users().messages().get(
+            userId="me", id=message_id, format="full", fields=data_fields(part_id)
+        ),
+        "gmail",
+    )
+    # Keep the content of this part only, not of its siblings
+    return next(
+        (
+            candidate.get("body", {}).get("data", "")
+            for candidate in _walk(message.get("payload", {}))
+            if candidate.get("partId") == part_id
+        ),
+        "",
+    )
+
+
+def _structure(service, message_id: str):
+    return execute(
+        service.users().messages().get(
+            userId="me", id=message_id, format="full", fields=STRUCTURE_FIELDS
+        ),
+        "gmail",
+        cache_key=f"structure:{message_id}",
+    )
+
+
+def read_email(message_id: str, max_chars: int = MAX_BODY_CHARS):
+    """
+    Reads the text of an email, without downloading its attachments.
+
+    Only the structure of the message is fetched first; then the content of
+    its text/plain part, or of its text/html part turned into plain text.
+
+    Args:
+        message_id: The id of the email, as given by search_emails or list_unread_emails.
+        max_chars: The maximum number of characters of the body to return.
+    """
+    creds = authenticate_google()
+    if not creds:
+        return "Authentication failed. Please ensure credentials.json is set up correctly."
+
+    try:
+        service = build("gmail", "v1", credentials=creds)
+
+        payload = _structure(service, message_id).get("payload", {})
+        parts = list(_walk(payload))
+        attachments = [part for part in parts if part.get("filename")]
+        body = next(
+            (p for p in parts if p.get("mimeType") == "text/plain" and not p.get("filename")),
+            None,
+        ) or next(
+            (p for p in parts if p.get("mimeType") == "text/html" and not p.get("filename")),
+            None,
+        )
+
+        text = f"From: {_header(payload, 'from')}\nSubject: {_header(payload, 'subject')}\nDate: {_header(payload, 'date')}\n\n"
+        if body is None:
+            text += "This email has no text."
+        elif _fetch_size(payload, body) > MAX_FETCH_BYTES:
+            text += "The text of this email is too large to be read."
+        else:
+            content, truncated = decode_body(
+                _part_data(service, message_id, body),
+                _charset(body),
+                body["mimeType"] == "text/html",
+                max_chars,
+            )
+            text += content or "This email has no text."
+            if truncated:
+                text += "\n[The rest of the email was cut.]"
+
+        if attachments:
+            text += "\n\nAttachments:\n" + "\n".join(
+                f"- {part['filename']} ({part.get('mimeType')}, {part.get('body', {}).get('size', 0) // 1024} KB)"
+                for part in attachments
+            )
+        return text
+
+    except HttpError as error:
+        return f"An error occurred: {error}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+
+def get_email_attachment(message_id: str, attachment: str, max_chars: int = MAX_BODY_CHARS):
+    """
+    Reads a text attachment of an email, downloading only that attachment.
+
+    Args:
+        message_id: The id of the email, as given by search_emails or list_unread_emails.
+        attachment: The file name of the attachment, as listed by read_email.
+        max_chars: The maximum number of characters to return.
+    """
+    creds = authenticate_google()
+    if not creds:
+        return "Authentication failed. Please ensure credentials.json is set up correctly."
+
+    try:
+        service = build("gmail", "v1", credentials=creds)
+
+        payload = _structure(service, message_id).get("payload", {})
+        # Attachment ids change with every request, so attachments are found by name.
+        candidates = [part for part in _walk(payload) if part.get("filename")]
+        part = next(
+            (p for p in candidates if p["filename"] == attachment),
+            None,
+        ) or next(
+            (p for p in candidates if attachment.lower() in p["filename"].lower()),
+            None,
+        )
+        if part is None:
+            return f"No attachment named '{attachment}' in this email."
+
+        mime_type = part.get("mimeType", "")
+        size = part.get("body", {}).get("size", 0)
+        if not mime_type.startswith("text/"):
+            return f"{part['filename']} is a {mime_type} file of {size // 1024} KB, it cannot be read aloud."
+        if _fetch_size(payload, part) > MAX_FETCH_BYTES:
+            return f"{part['filename']} is too large to be read ({size // 1024} KB)."
+
+        content, truncated = decode_body(
+            _part_data(service, message_id, part),
+            _charset(part),
+            mime_type == "text/html",
+            max_chars,
+        )
+        text = f"{part['filename']}:\n{content}"
+        if truncated:
+            text += "\n[The rest of the file was cut.]"
+        return text
+
+    except HttpError as error:
+        return f"An error occurred: {error}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
@@ -0,0 +1,218 @@
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger("google_quota")
+
+# Request priorities, lower runs first.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Requests per second and burst size allowed for each API and user. Kept
+# below Google's published per-user quotas so we throttle before they do.
+DEFAULT_RATES = {
+    "gmail": (float(os.getenv("GMAIL_RATE", "40")), 20),
+    "calendar": (float(os.getenv("CALENDAR_RATE", "8")), 10),
+    "tasks": (float(os.getenv("TASKS_RATE", "5")), 10),
+}
+FALLBACK_RATE = (5.0, 5)
+# Slowest rate reached after repeated 429s, as a fraction of the configured one.
+MIN_RATE_FACTOR = 0.1
+# Rate regained after each successful request, as a fraction of the configured one.
+RECOVERY_FACTOR = 0.02
+# Database holding the buckets shared by every job process of the host, as
+# they all spend the quota of the same accounts.
+QUOTA_PATH = os.getenv("GOOGLE_QUOTA_PATH", "google_quota.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    user TEXT NOT NULL,
+    api TEXT NOT NULL,
+    rate REAL NOT NULL,
+    tokens REAL NOT NULL,
+    paused_until REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (user, api)
+);
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to rate-limit responses.
+
+    A 429 halves the rate and pauses the bucket for the Retry-After delay;
+    every success then raises the rate back linearly towards the configured
+    one (AIMD), so throughput settles right under the real quota.
+
+    Times are wall-clock seconds, so the state means the same in every
+    process sharing it.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.paused_until = 0.0
+        self._updated = time.time()
+
+    def _refill(self, now: float):
+        start = max(self._updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def reserve(self, now: float) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def throttle(self, now: float, retry_after: Optional[float] = None):
+        self.rate = max(self.max_rate * MIN_RATE_FACTOR, self.rate / 2)
+        self.tokens = 0.0
+        self._updated = now
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_FACTOR)
+
+
+class QuotaScheduler:
+    """
+    Schedules Google API requests per user and per API.
+
+    Callers block in `acquire` until their bucket has a token. Waiting
+    requests are served by priority, then in arrival order, so interactive
+    requests overtake queued background work.
+
+    With a `path`, the buckets are kept in a SQLite database and every
+    process using it draws from the same tokens, so N job processes stay
+    under one account's quota instead of N times it. Priorities still only
+    order the requests of one process. Without a path, or if the database
+    cannot be used, each process has its own buckets.
+    """
+
+    def __init__(self, rates: Optional[dict] = None, path: Optional[str] = None):
+        self.rates = DEFAULT_RATES if rates is None else rates
+        self.path = path
+        self._buckets = {}
+        self._waiters = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        if path is not None:
+            try:
+                with self._connect() as db:
+                    db.executescript(SCHEMA)
+            except sqlite3.Error:
+                logger.exception(f"Cannot share quota state in {path}, using local buckets")
+                self.path = None
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _bucket(self, key) -> TokenBucket:
+        if key not in self._buckets:
+            rate, capacity = self.rates.get(key[1], FALLBACK_RATE)
+            self._buckets[key] = TokenBucket(rate, capacity)
+            self._waiters[key] = []
+        return self._buckets[key]
+
+    def _apply(self, key, operation):
+        """Runs `operation` on the key's bucket, loaded from and saved to the shared database."""
+        bucket = self._bucket(key)
+        if self.path is None:
+            return operation(bucket)
+        done = False
+        try:
+            with self._connect() as db:
+                # Lock the database so two processes cannot take the same token
+                db.execute("BEGIN IMMEDIATE")
+                row = db.execute(
+                    "SELECT rate, tokens, paused_until, updated FROM buckets"
+                    " WHERE user = ? AND api = ?",
+                    key,
+                ).fetchone()
+                if row:
+                    rate, bucket.tokens, bucket.paused_until, bucket._updated = row
+                    bucket.rate = min(rate, bucket.max_rate)
+                result = operation(bucket)
+                done = True
+                db.execute(
+                    "INSERT OR REPLACE INTO buckets"
+                    " (user, api, rate, tokens, paused_until, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (*key, bucket.rate, bucket.tokens, bucket.paused_until, bucket._updated),
+                )
+            return result
+        except sqlite3.Error:
+            logger.exception("Shared quota state unavailable, using the local bucket")
+            return result if done else operation(bucket)
+
+    def acquire(
+        self,
+        user: str,
+        api: str,
+        priority: int = INTERACTIVE,
+        timeout: Optional[float] = None,
+    ) -> bool:
+        """
+        Waits for permission to send one request.
+
+        Args:
+            user: The account the request is made for.
+            api: The API name ("gmail", "calendar", "tasks").
+            priority: INTERACTIVE or BACKGROUND.
+            timeout: Maximum seconds to wait, None to wait indefinitely.
+
+        Returns:
+            True if the request may be sent, False if the timeout expired first.
+        """
+        key = (user, api)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._bucket(key)
+            waiters = self._waiters[key]
+            entry = (priority, next(self._seq))
+            heapq.heappush(waiters, entry)
+            try:
+                while True:
+                    now = time.time()
+                    wait = None
+                    if waiters[0] == entry:
+                        wait = self._apply(key, lambda bucket, now=now: bucket.reserve(now))
+                        if wait == 0:
+                            return True
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                waiters.remove(entry)
+                heapq.heapify(waiters)
+                self._cond.notify_all()
+
+    def throttle(self, user: str, api: str, retry_after: Optional[float] = None):
+        """Slows down the bucket after Google answered with a rate-limit error."""
+        now = time.time()
+        with self._cond:
+            self._apply((user, api), lambda bucket: bucket.throttle(now, retry_after))
+
+    def record_success(self, user: str, api: str):
+        with self._cond:
+            self._apply((user, api), lambda bucket: bucket.recover())
+
+
+scheduler = QuotaScheduler(path=QUOTA_PATH)
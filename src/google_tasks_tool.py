@@ -1,9 +1,188 @@
 
+import difflib
+import re
+import threading
+import time
+from typing import Optional
+
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from google_api import execute
 from google_auth import authenticate_google
 
+# Seconds during which resolved task lists and tasks are reused without
+# asking the API again. Our own edits invalidate the cache immediately.
+CACHE_TTL = 300
+# Minimum similarity for a name to match a task or task list title.
+MATCH_THRESHOLD = 0.6
+# A task is only changed or deleted by name if it matches at least this well
+# and clearly better than the next task; otherwise the user is asked.
+CONFIDENT_MATCH = 0.85
+AMBIGUITY_MARGIN = 0.05
+# Shorter names only match a title exactly.
+MIN_FUZZY_LENGTH = 3
+# Tasks and task lists requested per page, the most the API allows.
+PAGE_SIZE = 100
+DEFAULT_TASK_LIST = "@default"
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(key, fetch, refresh: bool = False):
+    with _cache_lock:
+        entry = _cache.get(key)
+    if not refresh and entry and time.monotonic() - entry[0] < CACHE_TTL:
+        return entry[1]
+    items = fetch()
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), items)
+    return items
+
+
+def invalidate(task_list_id: Optional[str] = None):
+    """Forgets the cached tasks of a task list, or everything if no list is given."""
+    with _cache_lock:
+        if task_list_id is None:
+            _cache.clear()
+        else:
+            for key in [key for key in _cache if key[:2] == ("tasks", task_list_id)]:
+                del _cache[key]
+
+
+def _all_pages(list_request, cache_key: str):
+    """Returns the items of every page of a list request, called with a page token."""
+    items, page_token = [], None
+    while True:
+        page = execute(list_request(page_token), "tasks", cache_key=f"{cache_key}:{page_token}")
+        items += page.get("items", [])
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return items
+
+
+def _task_lists(service, refresh: bool = False):
+    return _cached(
+        ("tasklists",),
+        lambda: _all_pages(
+            lambda page_token: service.tasklists().list(maxResults=PAGE_SIZE, pageToken=page_token),
+            "tasklists",
+        ),
+        refresh,
+    )
+
+
+def _tasks(service, task_list_id: str, refresh: bool = False, show_completed: bool = True):
+    return _cached(
+        ("tasks", task_list_id, show_completed),
+        lambda: _all_pages(
+            lambda page_token: service.tasks().list(
+                tasklist=task_list_id,
+                maxResults=PAGE_SIZE,
+                pageToken=page_token,
+                showCompleted=show_completed,
+            ),
+            f"tasks:{task_list_id}:{show_completed}",
+        ),
+        refresh,
+    )
+
+
+def _score(name: str, title: str) -> float:
+    name, title = name.strip().lower(), (title or "").strip().lower()
+    if name == title:
+        return 1.0
+    if len(name) < MIN_FUZZY_LENGTH:
+        return 0.0
+    score = difflib.SequenceMatcher(None, name, title).ratio()
+    # Every word of the name in the title, e.g. "call plumber" for "Call the plumber"
+    words = set(re.findall(r"\w+", title))
+    if all(word in words for word in re.findall(r"\w+", name)):
+        score = max(score, 0.9)
+    return score
+
+
+def _best_match(name: str, items):
+    """Returns the item whose id is `name` or whose title matches it best, if any."""
+    best, best_score = None, MATCH_THRESHOLD
+    for item in items:
+        if item["id"] == name:
+            return item
+        score = _score(name, item.get("title"))
+        if score >= best_score:
+            best, best_score = item, score
+    return best
+
+
+def resolve_task_list(service, task_list: str):
+    """
+    Finds a task list from its id or (approximate) title.
+
+    Args:
+        service: The Tasks service returned by googleapiclient's build.
+        task_list: The id or the name of the task list.
+    """
+    match = _best_match(task_list, _task_lists(service))
+    if match is None:
+        # The list may have been created since the cache was filled.
+        match = _best_match(task_list, _task_lists(service, refresh=True))
+    return match
+
+
+def resolve_task(service, task: str, task_list: Optional[str] = None):
+    """
+    Finds the one task a user means from its id or title.
+
+    Since the task is about to be changed or deleted, a name must match a
+    single title exactly, or match it well and clearly better than any
+    other task; otherwise the close titles are returned for the user to
+    choose from.
+
+    Args:
+        service: The Tasks service returned by googleapiclient's build.
+        task: The id or the name of the task.
+        task_list: The id or the name of the task list, None to search all lists.
+
+    Returns:
+        A (task list id, task, candidates) tuple; task is None when nothing
+        matched or the name is ambiguous, candidates then lists the titles
+        the user may have meant.
+    """
+    for refresh in (False, True):
+        if task_list:
+            match = resolve_task_list(service, task_list)
+            if match is None:
+                return None, None, []
+            task_list_ids = [match["id"]]
+        else:
+            task_list_ids = [item["id"] for item in _task_lists(service, refresh)]
+
+        scored = []
+        for task_list_id in task_list_ids:
+            for item in _tasks(service, task_list_id, refresh):
+                if item["id"] == task:
+                    return task_list_id, item, []
+                score = _score(task, item.get("title"))
+                if score >= MATCH_THRESHOLD:
+                    scored.append((score, task_list_id, item))
+        if not scored:
+            continue
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+        best_score, best_list, best = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        if best_score >= CONFIDENT_MATCH and best_score - runner_up >= AMBIGUITY_MARGIN:
+            return best_list, best, []
+        return None, None, [item["title"] for _, _, item in scored[:5]]
+    return None, None, []
+
+
+def _no_single_task(task: str, candidates) -> str:
+    if not candidates:
+        return f"No task matching '{task}'."
+    return f"Several tasks could match '{task}': {', '.join(candidates)}. Ask the user which one they mean."
+
+
 def list_task_lists():
     """Lists the user's task lists."""
     creds = authenticate_google()
@@ -13,8 +192,7 @@ def list_task_lists():
     try:
         service = build("tasks", "v1", credentials=creds)
 
-        results = service.tasklists().list(maxResults=10).execute()
-        items = results.get("items", [])
+        items = _task_lists(service, refresh=True)
 
         if not items:
             return "No task lists found."
@@ -29,8 +207,8 @@ def list_task_lists():
     except Exception as e:
         return f"An unexpected error occurred: {e}"
 
-def list_tasks(task_list_id: str):
-    """Lists the tasks in a specific task list."""
+def list_tasks(task_list: str):
+    """Lists the tasks in a specific task list, given by id or name."""
     creds = authenticate_google()
     if not creds:
         return "Authentication failed. Please ensure credentials.json is set up correctly."
@@ -38,13 +216,15 @@ def list_tasks(task_list_id: str):
     try:
         service = build("tasks", "v1", credentials=creds)
 
-        results = service.tasks().list(tasklist=task_list_id).execute()
-        items = results.get("items", [])
+        match = resolve_task_list(service, task_list)
+        if match is None:
+            return f"No task list matching '{task_list}'."
+        items = _tasks(service, match["id"], refresh=True)
 
         if not items:
-            return f"No tasks found in task list {task_list_id}."
+            return f"No tasks found in task list {match['title']}."
 
-        tasks = f"Tasks in list {task_list_id}:\n"
+        tasks = f"Tasks in list {match['title']}:\n"
         for item in items:
             tasks += f"- {item['title']} ({item['id']})\n"
         return tasks
@@ -54,8 +234,8 @@ def list_tasks(task_list_id: str):
     except Exception as e:
         return f"An unexpected error occurred: {e}"
 
-def create_task(task_list_id: str, title: str, notes: str = None):
-    """Creates a new task."""
+def create_task(task_list: str, title: str, notes: Optional[str] = None):
+    """Creates a new task in a task list given by id or name (default list if empty)."""
     creds = authenticate_google()
     if not creds:
         return "Authentication failed. Please ensure credentials.json is set up correctly."
@@ -63,12 +243,25 @@ def create_task(task_list_id: str, title: str, notes: str = None):
     try:
         service = build("tasks", "v1", credentials=creds)
 
+        task_list_id = DEFAULT_TASK_LIST
+        if task_list:
+            match = resolve_task_list(service, task_list)
+            if match is None:
+                return f"No task list matching '{task_list}'."
+            task_list_id = match["id"]
+
         task = {
             'title': title,
             'notes': notes
         }
 
-        result = service.tasks().insert(tasklist=task_list_id, body=task).execute()
+        result = execute(
+            service.tasks().insert(tasklist=task_list_id, body=task),
+            "tasks",
+            idempotent=False,
+        )
+        # "@default" is an alias, so forget every list when it was used.
+        invalidate(task_list_id if task_list else None)
         return f"Task created: {result.get('title')}"
 
     except HttpError as error:
@@ -76,8 +269,14 @@ def create_task(task_list_id: str, title: str, notes: str = None):
     except Exception as e:
         return f"An unexpected error occurred: {e}"
 
-def update_task(task_list_id: str, task_id: str, title: str, notes: str = None):
-    """Updates a task."""
+def update_task(
+    task_list: str,
+    task: str,
+    title: Optional[str] = None,
+    notes: Optional[str] = None,
+    completed: Optional[bool] = None,
+):
+    """Updates a task given by id or name; only the given fields are changed."""
     creds = authenticate_google()
     if not creds:
         return "Authentication failed. Please ensure credentials.json is set up correctly."
@@ -85,11 +284,25 @@ def update_task(task_list_id: str, task_id: str, title: str, notes: str = None):
     try:
         service = build("tasks", "v1", credentials=creds)
 
-        task = service.tasks().get(tasklist=task_list_id, task=task_id).execute()
-        task['title'] = title
-        task['notes'] = notes
+        task_list_id, match, candidates = resolve_task(service, task, task_list)
+        if match is None:
+            return _no_single_task(task, candidates)
+
+        changes = {}
+        if title is not None:
+            changes['title'] = title
+        if notes is not None:
+            changes['notes'] = notes
+        if completed is not None:
+            changes['status'] = "completed" if completed else "needsAction"
+            if not completed:
+                changes['completed'] = None
 
-        result = service.tasks().update(tasklist=task_list_id, task=task_id, body=task).execute()
+        result = execute(
+            service.tasks().patch(tasklist=task_list_id, task=match["id"], body=changes),
+            "tasks",
+        )
+        invalidate(task_list_id)
         return f"Task updated: {result.get('title')}"
 
     except HttpError as error:
@@ -97,8 +310,8 @@ def update_task(task_list_id: str, task_id: str, title: str, notes: str = None):
     except Exception as e:
         return f"An unexpected error occurred: {e}"
 
-def delete_task(task_list_id: str, task_id: str):
-    """Deletes a task."""
+def delete_task(task_list: str, task: str):
+    """Deletes a task given by id or name."""
     creds = authenticate_google()
     if not creds:
         return "Authentication failed. Please ensure credentials.json is set up correctly."
@@ -106,10 +319,38 @@ def delete_task(task_list_id: str, task_id: str):
     try:
         service = build("tasks", "v1", credentials=creds)
 
-        service.tasks().delete(tasklist=task_list_id, task=task_id).execute()
+        task_list_id, match, candidates = resolve_task(service, task, task_list)
+        if match is None:
+            return _no_single_task(task, candidates)
+
+        execute(service.tasks().delete(tasklist=task_list_id, task=match["id"]), "tasks")
+        invalidate(task_list_id)
         return "Task deleted."
 
     except HttpError as error:
         return f"An error occurred: {error}"
     except Exception as e:
         return f"An unexpected error occurred: {e}"
+
+def list_open_tasks(n: int = 5):
+    """Lists up to N tasks not done yet, across all task lists."""
+    creds = authenticate_google()
+    if not creds:
+        return "Authentication failed. Please ensure credentials.json is set up correctly."
+
+    try:
+        service = build("tasks", "v1", credentials=creds)
+
+        tasks = []
+        for task_list in _task_lists(service):
+            for item in _tasks(service, task_list["id"], show_completed=False):
+                if item.get("status") != "completed":
+                    tasks.append(f"- {item['title']} ({task_list['title']})")
+        if not tasks:
+            return "No open tasks."
+        return "Open tasks:\n" + "\n".join(tasks[:n]) + "\n"
+
+    except HttpError as error:
+        return f"An error occurred: {error}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
@@ -0,0 +1,340 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from google_api import execute
+from google_auth import authenticate_google
+from google_quota import BACKGROUND
+
+logger = logging.getLogger("mail_index")
+
+INDEX_PATH = os.getenv("MAIL_INDEX_PATH", "mail_index.sqlite3")
+# Seconds between two incremental synchronizations with Gmail.
+SYNC_INTERVAL = float(os.getenv("MAIL_INDEX_SYNC_INTERVAL", "60"))
+# Number of most recent messages indexed by the first synchronization.
+INITIAL_SYNC_LIMIT = int(os.getenv("MAIL_INDEX_INITIAL_LIMIT", "500"))
+# Seconds the process synchronizing the index keeps the job without renewing
+# its lease, after which another process of the host takes over.
+SYNC_LEASE = float(os.getenv("MAIL_INDEX_SYNC_LEASE", "600"))
+# Messages fetched between two renewals of the lease during a full sync,
+# which are written to the index with the progress of the sync.
+LEASE_RENEWAL = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    sender TEXT,
+    subject TEXT,
+    snippet TEXT,
+    date INTEGER,
+    labels TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    sender, subject, snippet,
+    content='messages', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, sender, subject, snippet)
+    VALUES (new.rowid, new.sender, new.subject, new.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, subject, snippet)
+    VALUES ('delete', old.rowid, old.sender, old.subject, old.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, subject, snippet)
+    VALUES ('delete', old.rowid, old.sender, old.subject, old.snippet);
+    INSERT INTO messages_fts (rowid, sender, subject, snippet)
+    VALUES (new.rowid, new.sender, new.subject, new.snippet);
+END;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class MailIndex:
+    """
+    Local full-text index of the mailbox's senders, subjects and snippets.
+
+    The index is filled once with the most recent messages, then kept up to
+    date incrementally from the Gmail history API, so searches never leave
+    the machine and answer in milliseconds.
+
+    Every job process of the host shares the database, but only the one
+    holding the lease stored in the meta table synchronizes it; the others
+    take over when the lease expires.
+    """
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self.owner = uuid.uuid4().hex
+        self._sync_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def ready(self) -> bool:
+        """Returns False until the first full synchronization has completed."""
+        return self._get_meta("history_id") is not None
+
+    def search(self, query: str, limit: int = 5):
+        """
+        Searches the index and returns the best matching messages first.
+
+        Every word of the query is matched as a prefix. If no message
+        contains all the words, messages containing any of them are returned.
+
+        Args:
+            query: Keywords such as a sender name or a topic.
+            limit: The maximum number of messages to return.
+        """
+        words = re.findall(r"\w+", query.lower())
+        if not words:
+            return []
+        terms = [f'"{word}"*' for word in words]
+        with self._connect() as db:
+            for match in (" AND ".join(terms), " OR ".join(terms)):
+                rows = db.execute(
+                    "SELECT m.id, m.sender, m.subject, m.snippet, m.date"
+                    " FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid"
+                    " WHERE messages_fts MATCH ?"
+                    " ORDER BY bm25(messages_fts, 5.0, 3.0, 1.0), m.date DESC LIMIT ?",
+                    (match, limit),
+                ).fetchall()
+                if rows:
+                    break
+        return [
+            {"id": id_, "sender": sender, "subject": subject, "snippet": snippet, "date": date}
+            for id_, sender, subject, snippet, date in rows
+        ]
+
+    def sync(self, service) -> int:
+        """
+        Brings the index up to date and returns the number of changed messages.
+
+        Args:
+            service: The Gmail service returned by googleapiclient's build.
+        """
+        with self._sync_lock:
+            history_id = self._get_meta("history_id")
+            if history_id is not None:
+                try:
+                    return self._sync_history(service, history_id)
+                except HttpError as error:
+                    if error.resp.status != 404:
+                        raise
+                    # The history id is too old, Gmail no longer has it.
+                    logger.info("Mail history expired, rebuilding the index")
+            return self._sync_full(service)
+
+    def _sync_full(self, service) -> int:
+        """
+        Indexes the most recent messages, in batches.
+
+        Each batch is written with the progress of the sync, so a failure
+        only loses the current batch and the next sync resumes from there.
+        """
+        progress = self._get_meta("full_sync")
+        if progress:
+            progress = json.loads(progress)
+        else:
+            progress = {"history_id": self._history_id(service), "ids": self._recent_ids(service), "done": 0}
+            with self._connect() as db:
+                self._set_meta(db, "full_sync", json.dumps(progress))
+
+        ids = progress["ids"]
+        fetched = 0
+        while progress["done"] < len(ids):
+            batch = ids[progress["done"] : progress["done"] + LEASE_RENEWAL]
+            messages = [self._fetch(service, message_id) for message_id in batch]
+            progress["done"] += len(batch)
+            fetched += len(batch)
+            with self._connect() as db:
+                self._store(db, [m for m in messages if m])
+                self._set_meta(db, "full_sync", json.dumps(progress))
+            self._take_lease()
+
+        with self._connect() as db:
+            # Messages left from an earlier index, and no longer among the recent ones
+            db.execute("DELETE FROM messages WHERE id NOT IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+            self._set_meta(db, "history_id", progress["history_id"])
+            db.execute("DELETE FROM meta WHERE key = 'full_sync'")
+        return fetched
+
+    def _history_id(self, service) -> str:
+        return execute(service.users().getProfile(userId="me"), "gmail", priority=BACKGROUND)["historyId"]
+
+    def _recent_ids(self, service) -> list:
+        ids = []
+        page_token = None
+        while len(ids) < INITIAL_SYNC_LIMIT:
+            page = execute(
+                service.users().messages().list(
+                    userId="me",
+                    maxResults=min(500, INITIAL_SYNC_LIMIT - len(ids)),
+                    pageToken=page_token,
+                ),
+                "gmail",
+                priority=BACKGROUND,
+            )
+            ids += [message["id"] for message in page.get("messages", [])]
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                break
+        return ids
+
+    def _sync_history(self, service, history_id: str) -> int:
+        added, deleted = set(), set()
+        page_token = None
+        while True:
+            page = execute(
+                service.users().history().list(
+                    userId="me",
+                    startHistoryId=history_id,
+                    historyTypes=["messageAdded", "messageDeleted"],
+                    pageToken=page_token,
+                ),
+                "gmail",
+                priority=BACKGROUND,
+            )
+            for record in page.get("history", []):
+                for change in record.get("messagesAdded", []):
+                    added.add(change["message"]["id"])
+                    deleted.discard(change["message"]["id"])
+                for change in record.get("messagesDeleted", []):
+                    deleted.add(change["message"]["id"])
+                    added.discard(change["message"]["id"])
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                break
+
+        messages = [self._fetch(service, message_id) for message_id in added]
+        with self._connect() as db:
+            db.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in deleted])
+            self._store(db, [m for m in messages if m])
+            self._set_meta(db, "history_id", page["historyId"])
+        return len(added) + len(deleted)
+
+    def _fetch(self, service, message_id: str):
+        try:
+            msg = execute(
+                service.users().messages().get(
+                    userId="me",
+                    id=message_id,
+                    format="metadata",
+                    metadataHeaders=["From", "Subject"],
+                ),
+                "gmail",
+                priority=BACKGROUND,
+            )
+        except HttpError as error:
+            if error.resp.status == 404:
+                # Deleted between the listing and the fetch.
+                return None
+            raise
+        headers = msg.get("payload", {}).get("headers", [])
+        return (
+            msg["id"],
+            next((h["value"] for h in headers if h["name"] == "From"), None),
+            next((h["value"] for h in headers if h["name"] == "Subject"), None),
+            msg.get("snippet", ""),
+            int(msg.get("internalDate", 0)),
+            ",".join(msg.get("labelIds", [])),
+        )
+
+    def _store(self, db, messages):
+        db.executemany(
+            "INSERT INTO messages (id, sender, subject, snippet, date, labels)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET"
+            " sender = excluded.sender, subject = excluded.subject,"
+            " snippet = excluded.snippet, date = excluded.date, labels = excluded.labels",
+            messages,
+        )
+
+    def _get_meta(self, key: str):
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, db, key: str, value):
+        db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    def _take_lease(self) -> bool:
+        """Takes or renews the synchronization lease, returning False if another process holds it."""
+        now = time.time()
+        with self._connect() as db:
+            # Lock the database so two processes cannot both see the lease expired
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT value FROM meta WHERE key = 'sync_lease'").fetchone()
+            if row:
+                holder, _, expires = row[0].partition(" ")
+                if holder != self.owner and float(expires or 0) > now:
+                    return False
+            self._set_meta(db, "sync_lease", f"{self.owner} {now + SYNC_LEASE}")
+        return True
+
+    def _release_lease(self):
+        with self._connect() as db:
+            db.execute(
+                "DELETE FROM meta WHERE key = 'sync_lease' AND value LIKE ?", (f"{self.owner} %",)
+            )
+
+    def start(self, interval: float = SYNC_INTERVAL):
+        """Starts a background thread synchronizing the index every `interval` seconds."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="mail-index", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self, interval: float):
+        service = None
+        while not self._stopping.is_set():
+            try:
+                if self._take_lease():
+                    if service is None:
+                        service = build("gmail", "v1", credentials=authenticate_google())
+                    changed = self.sync(service)
+                    logger.info(f"Mail index synchronized, {changed} messages changed")
+            except Exception:
+                logger.exception("Mail index synchronization failed")
+            self._stopping.wait(interval)
+        try:
+            self._release_lease()
+        except sqlite3.Error:
+            logger.exception("Could not release the mail index lease")
+
+
+_index = None
+
+
+def get_index() -> MailIndex:
+    """Returns the process-wide mail index, creating it on first use."""
+    global _index
+    if _index is None:
+        _index = MailIndex()
+    return _index
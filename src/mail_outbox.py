@@ -0,0 +1,338 @@
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from google_api import GoogleApiUnavailableError, is_rate_limited
+from google_auth import authenticate_google
+from google_mail_tool import deliver_email
+from google_quota import BACKGROUND
+
+logger = logging.getLogger("mail_outbox")
+
+OUTBOX_PATH = os.getenv("MAIL_OUTBOX_PATH", "outbox.sqlite3")
+MAX_ATTEMPTS = 5
+RETRY_BASE = 5.0
+RETRY_CAP = 300.0
+# Identical emails queued within this many seconds are sent only once.
+# Delivered or abandoned emails are deleted once this window has passed.
+DEDUP_WINDOW = 600
+# Maximum number of emails delivered per wake-up, over one Gmail connection.
+BATCH_SIZE = 20
+# Seconds an email stays claimed by the process delivering it.
+CLAIM_LEASE = 120
+# Seconds between two heartbeats of the session owning queued emails, and
+# after which a silent owner's emails may be delivered by another process.
+HEARTBEAT_INTERVAL = 30
+OWNER_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+# The send failed in a way that does not tell whether Gmail sent the email.
+UNKNOWN = "unknown"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    message_id TEXT,
+    error TEXT,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_dedup ON outbox (dedup_key, created_at);
+CREATE TABLE IF NOT EXISTS owners (
+    owner TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+"""
+
+# Emails a process may deliver: its own, and those of sessions that ended or
+# stopped sending heartbeats, so nothing stays queued forever.
+CLAIMABLE = """
+    status = ? AND (
+        owner = ? OR owner IS NULL
+        OR owner NOT IN (SELECT owner FROM owners WHERE seen_at > ?)
+    )
+"""
+
+
+class MailOutbox:
+    """
+    Durable queue of outgoing emails, delivered by a background thread.
+
+    Emails are written to a local SQLite database before `enqueue` returns,
+    so the voice turn never waits for Gmail and queued emails survive a
+    restart. Deliveries Gmail is known not to have applied (rate limits,
+    refused connections) are retried with jittered exponential backoff; an
+    email whose send may have gone through is marked unknown rather than
+    sent twice. Every final outcome (sent, failed or unknown) is passed to
+    the status callbacks.
+
+    Every job process of the host shares the database. Each email records
+    the session that queued it in `owner`; only that session delivers it
+    and hears about its outcome, unless the session is gone, in which case
+    any process delivers it.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH, owner: Optional[str] = None):
+        self.path = path
+        self.owner = owner or uuid.uuid4().hex
+        self._callbacks = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            columns = [row[1] for row in db.execute("PRAGMA table_info(outbox)")]
+            if "owner" not in columns:
+                db.execute("ALTER TABLE outbox ADD COLUMN owner TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def on_status(self, callback):
+        """Registers a callback receiving each email's final status as a dict."""
+        self._callbacks.append(callback)
+
+    def enqueue(self, to: str, subject: str, message_text: str):
+        """
+        Queues an email for delivery.
+
+        Args:
+            to: The recipient's email address.
+            subject: The subject of the email.
+            message_text: The body of the email.
+
+        Returns:
+            A (id, duplicate) tuple; duplicate is True when the same email was
+            already queued or sent recently and nothing new was queued.
+        """
+        dedup_key = hashlib.sha256(
+            "\0".join((to.strip().lower(), subject, message_text)).encode()
+        ).hexdigest()
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT id FROM outbox WHERE dedup_key = ? AND created_at > ?"
+                " AND status NOT IN (?, ?)",
+                (dedup_key, now - DEDUP_WINDOW, FAILED, UNKNOWN),
+            ).fetchone()
+            if row:
+                return row[0], True
+            self._heartbeat(db, now)
+            cursor = db.execute(
+                "INSERT INTO outbox (dedup_key, recipient, subject, body, status,"
+                " next_attempt_at, created_at, owner) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (dedup_key, to, subject, message_text, PENDING, now, now, self.owner),
+            )
+        self._wakeup.set()
+        return cursor.lastrowid, False
+
+    def start(self):
+        """Starts the background sender thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="mail-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stops the sender thread, letting it finish the current batch.
+
+        Emails still queued are handed over to the other processes.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        with self._connect() as db:
+            db.execute("DELETE FROM owners WHERE owner = ?", (self.owner,))
+
+    def _heartbeat(self, db, now: float):
+        db.execute(
+            "INSERT OR REPLACE INTO owners (owner, seen_at) VALUES (?, ?)", (self.owner, now)
+        )
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self._connect() as db:
+                    self._heartbeat(db, time.time())
+                self.purge()
+                self.flush()
+                wait = self._next_wakeup()
+            except Exception:
+                logger.exception("Mail outbox flush failed")
+                wait = RETRY_BASE
+            self._wakeup.wait(HEARTBEAT_INTERVAL if wait is None else min(wait, HEARTBEAT_INTERVAL))
+            self._wakeup.clear()
+
+    def _next_wakeup(self):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                f"SELECT MIN(next_attempt_at) FROM outbox WHERE {CLAIMABLE}",
+                (PENDING, self.owner, now - OWNER_TIMEOUT),
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - now)
+
+    def purge(self) -> int:
+        """
+        Deletes the emails whose outcome is known and older than DEDUP_WINDOW.
+
+        They are no longer needed to detect duplicates, and keeping them would
+        leave every recipient and body on disk forever.
+        """
+        now = time.time()
+        with self._connect() as db:
+            deleted = db.execute(
+                "DELETE FROM outbox WHERE status != ? AND created_at < ?",
+                (PENDING, now - DEDUP_WINDOW),
+            ).rowcount
+            db.execute("DELETE FROM owners WHERE seen_at < ?", (now - OWNER_TIMEOUT,))
+        return deleted
+
+    def flush(self) -> int:
+        """Delivers the emails that are due now and returns how many were attempted."""
+        now = time.time()
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT id, recipient, subject, body, attempts, owner FROM outbox"
+                f" WHERE {CLAIMABLE} AND next_attempt_at <= ?"
+                " ORDER BY next_attempt_at LIMIT ?",
+                (PENDING, self.owner, now - OWNER_TIMEOUT, now, BATCH_SIZE),
+            ).fetchall()
+            # Two processes may pick up the same orphaned email: only deliver
+            # the emails this process managed to claim.
+            due = [
+                row
+                for row in rows
+                if db.execute(
+                    "UPDATE outbox SET next_attempt_at = ?"
+                    " WHERE id = ? AND status = ? AND next_attempt_at <= ?",
+                    (now + CLAIM_LEASE, row[0], PENDING, now),
+                ).rowcount
+            ]
+        if not due:
+            return 0
+
+        try:
+            creds = authenticate_google()
+        except Exception as error:
+            # Nothing was sent, the emails can be tried again
+            logger.exception("Mail outbox could not authenticate with Google")
+            for email_id, to, subject, _, attempts, owner in due:
+                self._failed(email_id, to, subject, attempts + 1, owner, error, PENDING)
+            return len(due)
+        if not creds:
+            error = "Authentication failed. Please ensure credentials.json is set up correctly."
+            for email_id, to, subject, _, attempts, owner in due:
+                self._failed(email_id, to, subject, attempts + 1, owner, error, FAILED)
+            return len(due)
+
+        service = build("gmail", "v1", credentials=creds)
+        for email_id, to, subject, body, attempts, owner in due:
+            self._deliver(service, email_id, to, subject, body, attempts + 1, owner)
+        return len(due)
+
+    def _deliver(self, service, email_id, to, subject, body, attempt, owner=None):
+        try:
+            sent = deliver_email(service, to, subject, body, priority=BACKGROUND)
+        except Exception as error:
+            self._failed(email_id, to, subject, attempt, owner, error, _failure_status(error))
+            return
+        self._finish(email_id, SENT, attempt, message_id=sent.get("id"))
+        self._notify(email_id, to, subject, SENT, owner=owner)
+
+    def _failed(self, email_id, to, subject, attempt, owner, error, status):
+        """Records a failed attempt, retrying PENDING emails until MAX_ATTEMPTS."""
+        if status == PENDING and attempt >= MAX_ATTEMPTS:
+            status = FAILED
+        if status != PENDING:
+            self._finish(email_id, status, attempt, error=str(error))
+            self._notify(email_id, to, subject, status, str(error), owner)
+            return
+        delay = random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2**attempt))
+        logger.info(f"Email {email_id} to {to} failed, retrying in {delay:.0f}s: {error}")
+        with self._connect() as db:
+            db.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, error = ?"
+                " WHERE id = ?",
+                (attempt, time.time() + delay, str(error), email_id),
+            )
+
+    def _finish(self, email_id, status, attempt, message_id=None, error=None):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, message_id = ?, error = ?"
+                " WHERE id = ?",
+                (status, attempt, message_id, error, email_id),
+            )
+
+    def _notify(self, email_id, to, subject, status, error=None, owner=None):
+        # The session that queued the email is the one to tell, and only it
+        if owner != self.owner:
+            return
+        entry = {"id": email_id, "to": to, "subject": subject, "status": status, "error": error}
+        for callback in self._callbacks:
+            try:
+                callback(entry)
+            except Exception:
+                logger.exception("Mail outbox status callback failed")
+
+
+def _failure_status(error) -> str:
+    """
+    Returns what a failed send means for the email.
+
+    PENDING when Gmail certainly did not send it and it can be retried,
+    FAILED when Gmail rejected it, UNKNOWN when it may have been sent.
+    """
+    if isinstance(error, HttpError):
+        if is_rate_limited(error):
+            return PENDING
+        return UNKNOWN if error.resp.status >= 500 else FAILED
+    if isinstance(error, GoogleApiUnavailableError):
+        return UNKNOWN if error.maybe_sent else PENDING
+    if isinstance(error, ConnectionRefusedError):
+        return PENDING
+    return UNKNOWN
+
+
+_outbox = None
+
+
+def get_outbox(owner: Optional[str] = None) -> MailOutbox:
+    """
+    Returns the process-wide outbox, creating it on first use.
+
+    Args:
+        owner: Identifier of the session now running in this process, which
+            emails queued from here on belong to.
+    """
+    global _outbox
+    if _outbox is None:
+        _outbox = MailOutbox(owner=owner)
+    elif owner is not None:
+        _outbox.owner = owner
+    return _outbox
@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from livekit.agents import inference, llm, stt, tts
+
+logger = logging.getLogger("providers")
+
+# JSON file overriding DEFAULT_PROFILES, e.g.
+# {"stt": ["deepgram/nova-3:en"], "llm": ["openai/gpt-4.1-mini"], "tts": [...]}
+PROVIDERS_CONFIG = os.getenv("PROVIDERS_CONFIG", "providers.json")
+# Latency samples shared by every worker process of the host.
+PROVIDER_STATS_PATH = os.getenv("PROVIDER_STATS_PATH", "provider_stats.json")
+# Language the user speaks, as a code ("fr") or a name ("French").
+PREFERRED_LANGUAGE = os.getenv("PREFERRED_LANGUAGE")
+
+# Candidate STT models by language. Every candidate of a session must
+# transcribe the same language, or a failover would switch it.
+STT_PROFILES = {
+    "en": [
+        "assemblyai/universal-streaming:en",
+        "deepgram/nova-3:en",
+        "cartesia/ink-whisper:en",
+    ],
+    "fr": [
+        "deepgram/nova-3:fr",
+        "cartesia/ink-whisper:fr",
+    ],
+}
+LANGUAGE_NAMES = {"english": "en", "french": "fr", "francais": "fr", "français": "fr"}
+DEFAULT_LANGUAGE = "en"
+
+# Candidate models for each stage, in order of preference.
+DEFAULT_PROFILES = {
+    "stt": STT_PROFILES[DEFAULT_LANGUAGE],
+    "llm": [
+        "openai/gpt-4.1-mini",
+        "google/gemini-2.0-flash",
+    ],
+    # A fallback from another provider, with a voice close to the first one
+    # (Blake and Chris, both American adult male voices)
+    "tts": [
+        "cartesia/sonic-2:a167e0f3-df7e-4d52-a9c3-f949145efdab",
+        "elevenlabs/eleven_turbo_v2_5:iP95p4xoKVk53GoZ742B",
+    ],
+}
+# Seconds a provider may take before the session fails over to the next one.
+ATTEMPT_TIMEOUTS = {"stt": 10.0, "llm": 5.0, "tts": 10.0}
+
+# Only samples younger than this are used to rank providers.
+SAMPLE_WINDOW = 3600
+MAX_SAMPLES = 50
+# A provider failing this many times within FAILURE_WINDOW is skipped.
+MAX_FAILURES = 3
+FAILURE_WINDOW = 300
+# Share of sessions that try a provider other than the fastest one, so
+# the stats of the alternatives stay fresh.
+EXPLORATION_RATE = 0.1
+
+
+def language_code(language: Optional[str]) -> str:
+    """Returns the code of a language given by code or name, DEFAULT_LANGUAGE if unknown."""
+    language = (language or "").strip().lower()
+    code = LANGUAGE_NAMES.get(language, language.split("-")[0].split("_")[0])
+    return code if code in STT_PROFILES else DEFAULT_LANGUAGE
+
+
+def _same_language(models: list) -> list:
+    """Keeps the STT models transcribing the language of the first one."""
+    language = models[0].partition(":")[2] if models else ""
+    kept = [model for model in models if model.partition(":")[2] == language]
+    if len(kept) < len(models):
+        logger.warning(f"Ignoring STT models not transcribing '{language}': {sorted(set(models) - set(kept))}")
+    return kept
+
+
+def load_profiles(path: str = PROVIDERS_CONFIG, language: Optional[str] = PREFERRED_LANGUAGE) -> dict:
+    """
+    Returns the candidate models of each stage, from the config file if any.
+
+    Args:
+        path: The JSON file overriding the default profiles.
+        language: The language the user speaks, which picks the STT models.
+    """
+    profiles = dict(DEFAULT_PROFILES, stt=STT_PROFILES[language_code(language)])
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles.update(json.load(f))
+    for kind in profiles:
+        env = os.getenv(f"{kind.upper()}_PROVIDERS")
+        if env:
+            profiles[kind] = [model.strip() for model in env.split(",") if model.strip()]
+    profiles["stt"] = _same_language(profiles["stt"])
+    return profiles
+
+
+def _model_key(model: str) -> str:
+    # Metrics report "provider/model" without the voice or language suffix.
+    return model.split(":", 1)[0]
+
+
+def _configured_model(reported: str, current: str) -> str:
+    """Returns the configured model string, with its suffix, of a model named by metrics."""
+    if current and _model_key(current) == _model_key(reported):
+        return current
+    return reported
+
+
+class ProviderStats:
+    """
+    Rolling latency and failure statistics per model string.
+
+    Stats are kept per full model string, so two voices or languages of the
+    same model are ranked, and fail, separately.
+
+    Latencies are time to first token (LLM), time to first byte (TTS) and
+    transcription delay after end of speech (STT). Samples are persisted to
+    a JSON file so new sessions on the host start from what earlier ones saw.
+    """
+
+    def __init__(self, path: str = PROVIDER_STATS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._failures = {}
+        self._dirty = set()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._latencies = {k: [tuple(s) for s in v] for k, v in data.get("latencies", {}).items()}
+        self._failures = data.get("failures", {})
+
+    def save(self):
+        """Writes our samples to the shared file, keeping other processes' ones."""
+        with self._lock:
+            if not self._dirty:
+                return
+            other = ProviderStats.__new__(ProviderStats)
+            other.path = self.path
+            other._latencies, other._failures = {}, {}
+            other._load()
+            for key in self._dirty:
+                other._latencies[key] = self._latencies.get(key, [])
+                other._failures[key] = self._failures.get(key, [])
+            self._latencies, self._failures = other._latencies, other._failures
+            self._dirty.clear()
+            data = {"latencies": self._latencies, "failures": self._failures}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def record_latency(self, model: str, seconds: float):
+        key = model
+        with self._lock:
+            samples = self._latencies.setdefault(key, [])
+            samples.append((time.time(), seconds))
+            del samples[:-MAX_SAMPLES]
+            self._dirty.add(key)
+
+    def record_failure(self, model: str):
+        key = model
+        with self._lock:
+            failures = self._failures.setdefault(key, [])
+            failures.append(time.time())
+            del failures[:-MAX_FAILURES]
+            self._dirty.add(key)
+
+    def latency(self, model: str):
+        """Returns the 90th percentile latency over SAMPLE_WINDOW, None without samples."""
+        since = time.time() - SAMPLE_WINDOW
+        with self._lock:
+            samples = sorted(s for t, s in self._latencies.get(model, []) if t >= since)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+
+    def healthy(self, model: str) -> bool:
+        since = time.time() - FAILURE_WINDOW
+        with self._lock:
+            recent = [t for t in self._failures.get(model, []) if t >= since]
+        return len(recent) < MAX_FAILURES
+
+    def rank(self, models: list) -> list:
+        """
+        Orders models from the one new sessions should use first to the last resort.
+
+        Healthy models come first, fastest first; models without samples keep
+        their configured order after the measured ones. Unhealthy models are
+        kept last so the session still has somewhere to fail over to.
+        """
+        def key(item):
+            position, model = item
+            latency = self.latency(model)
+            return (not self.healthy(model), latency is None, latency or 0.0, position)
+
+        ranked = [model for _, model in sorted(enumerate(models), key=key)]
+        healthy = [model for model in ranked if self.healthy(model)]
+        if len(healthy) > 1 and random.random() < EXPLORATION_RATE:
+            explored = random.choice(healthy[1:])
+            ranked.remove(explored)
+            ranked.insert(0, explored)
+        return ranked
+
+    def collect(self, metrics, active: Optional[dict] = None):
+        """
+        Records the latency carried by a metrics_collected event's metrics.
+
+        Args:
+            metrics: The metrics of the event.
+            active: The model string in use for each stage, which gives the
+                voice or language the metrics leave out.
+        """
+        active = active or {}
+        model = getattr(getattr(metrics, "metadata", None), "model_name", None)
+        if metrics.type == "llm_metrics" and model and not metrics.cancelled:
+            self.record_latency(_configured_model(model, active.get("llm")), metrics.ttft)
+        elif metrics.type == "tts_metrics" and model and not metrics.cancelled:
+            self.record_latency(_configured_model(model, active.get("tts")), metrics.ttfb)
+        elif metrics.type == "eou_metrics" and active.get("stt") and metrics.transcription_delay > 0:
+            self.record_latency(active["stt"], metrics.transcription_delay)
+
+
+class ProviderSelector:
+    """
+    Builds the STT, LLM and TTS of a session from the configured profiles.
+
+    Each stage gets its candidates ranked by ProviderStats, wrapped in a
+    FallbackAdapter so the session switches to the next candidate as soon as
+    the current one errors or exceeds its attempt timeout.
+    """
+
+    def __init__(
+        self, stats: Optional[ProviderStats] = None, profiles: Optional[dict] = None
+    ):
+        self.stats = stats or ProviderStats()
+        self.profiles = profiles or load_profiles()
+        self.active = {}
+        # Model string each component was built from, by component id
+        self._models = {}
+
+    def build(self, vad=None) -> dict:
+        """Returns the stt, llm and tts arguments of AgentSession."""
+        ranked = {kind: self.stats.rank(self.profiles[kind]) for kind in ("stt", "llm", "tts")}
+        self.active = {kind: models[0] for kind, models in ranked.items()}
+        logger.info(f"Selected providers: {self.active}")
+
+        stts = [inference.STT.from_model_string(m) for m in ranked["stt"]]
+        llms = [inference.LLM.from_model_string(m) for m in ranked["llm"]]
+        ttss = [inference.TTS.from_model_string(m) for m in ranked["tts"]]
+        for models, built in ((ranked["stt"], stts), (ranked["llm"], llms), (ranked["tts"], ttss)):
+            self._models.update((id(component), model) for model, component in zip(models, built))
+        components = {
+            "stt": stts[0] if len(stts) == 1 else stt.FallbackAdapter(
+                stts, vad=vad, attempt_timeout=ATTEMPT_TIMEOUTS["stt"]
+            ),
+            "llm": llms[0] if len(llms) == 1 else llm.FallbackAdapter(
+                llms, attempt_timeout=ATTEMPT_TIMEOUTS["llm"]
+            ),
+            "tts": ttss[0] if len(ttss) == 1 else tts.FallbackAdapter(ttss),
+        }
+        for kind, component in components.items():
+            if len(ranked[kind]) > 1:
+                component.on(
+                    f"{kind}_availability_changed",
+                    self._availability_handler(kind, ranked[kind]),
+                )
+        return components
+
+    def _availability_handler(self, kind: str, models: list):
+        def on_availability_changed(ev):
+            component = getattr(ev, kind)
+            model = self._models.get(id(component), component.model)
+            if ev.available:
+                return
+            self.stats.record_failure(model)
+            # The adapter moves on to the next model that is still available.
+            if self.active[kind] == model and model in models:
+                index = models.index(model)
+                if index + 1 < len(models):
+                    self.active[kind] = models[index + 1]
+            logger.warning(f"{kind} provider {model} degraded, now using {self.active[kind]}")
+
+        return on_availability_changed
+
+    def collect(self, metrics):
+        """Feeds a metrics_collected event's metrics to the stats."""
+        self.stats.collect(metrics, active=self.active)
@@ -0,0 +1,71 @@
+import gc
+import logging
+import sys
+
+import psutil
+from livekit.agents import Plugin
+from livekit.plugins import silero
+
+logger = logging.getLogger("shared_models")
+
+# Models built in the forkserver, inherited by every job process it forks.
+_vad = None
+
+
+def _in_forkserver() -> bool:
+    # The forkserver is started with "python -c 'from multiprocessing.forkserver ...'"
+    return sys.argv == ["-c"] and "multiprocessing.forkserver" in sys.modules
+
+
+def vad() -> silero.VAD:
+    """
+    Returns the Silero VAD of the process.
+
+    On Linux, job processes are forked from a forkserver which built the VAD
+    before forking, so its weights are shared copy-on-write by every process
+    of the host instead of being loaded again by each one. Elsewhere, or if
+    the forkserver could not build it, the VAD is loaded here.
+    """
+    global _vad
+    if _vad is None:
+        _vad = silero.VAD.load()
+    return _vad
+
+
+def memory_usage() -> dict:
+    """Returns the RSS, USS and PSS of this process, in MB.
+
+    USS is the memory only this process uses, i.e. what one more process
+    costs the host; PSS splits shared pages between the processes using them.
+    """
+    info = psutil.Process().memory_full_info()
+    return {
+        key: round(getattr(info, key) / 2**20, 1)
+        for key in ("rss", "uss", "pss")
+        if hasattr(info, key)
+    }
+
+
+class SharedModelsPlugin(Plugin):
+    """
+    Makes the worker import this module in its forkserver.
+
+    The worker preloads the package of every registered plugin in the
+    forkserver, which is how the models below end up built there once.
+    """
+
+    def __init__(self):
+        super().__init__("shared_models", "1.0.0", __name__, logger)
+
+
+Plugin.register_plugin(SharedModelsPlugin())
+
+if _in_forkserver():
+    try:
+        vad()
+        # Keep the garbage collector from writing to the inherited objects,
+        # which would copy their pages into every child
+        gc.freeze()
+        logger.info(f"Preloaded shared models, memory: {memory_usage()}")
+    except Exception as e:
+        logger.warning(f"Could not preload shared models: {e!r}")
@@ -0,0 +1,113 @@
+import re
+import unicodedata
+
+# Function tools of the Assistant, by integration.
+TOOL_GROUPS = {
+    "calendar": [
+        "schedule_google_calendar_event",
+        "get_next_scheduled_google_calendar_events",
+    ],
+    "mail": [
+        "send_google_mail",
+        "list_google_unread_emails",
+        "search_google_emails",
+        "read_google_email",
+        "read_google_email_attachment",
+    ],
+    "tasks": [
+        "list_google_task_lists",
+        "list_google_tasks",
+        "create_google_task",
+        "update_google_task",
+        "delete_google_task",
+    ],
+    "utility": ["lookup_weather"],
+}
+# Tools offered on every turn.
+ALWAYS_ON = ["enable_tools", "get_daily_briefing"]
+
+# Word prefixes (accents removed) announcing that a group will be needed.
+KEYWORDS = {
+    "calendar": [
+        "calendar", "agenda", "meeting", "event", "schedul", "appointment",
+        "reunion", "rendez", "rdv", "evenement", "planifi", "calendrier",
+    ],
+    "mail": [
+        "mail", "email", "e-mail", "inbox", "message", "send", "sent", "wrote", "write",
+        "repl", "answer", "respond", "attachment", "piece jointe",
+        "courriel", "envoi", "envoy", "ecri", "repon",
+    ],
+    "tasks": [
+        "task", "todo", "to-do", "to do", "remind", "groceries", "shopping", "buy",
+        "need to", "done", "mark", "finish", "complete",
+        "tache", "liste", "course", "rappel", "achet", "termin", "fini", "faut",
+    ],
+    "utility": ["weather", "temperature", "rain", "forecast", "meteo", "pluie"],
+}
+# Number of turns a group stays loaded after it was last asked for.
+IDLE_TURNS = 4
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def route(text: str) -> set:
+    """Returns the tool groups the given user message is likely to need."""
+    text = _normalize(text)
+    return {
+        group
+        for group, keywords in KEYWORDS.items()
+        if any(re.search(rf"\b{re.escape(keyword)}", text) for keyword in keywords)
+    }
+
+
+class ToolRouter:
+    """
+    Decides which tool groups are loaded for each user turn.
+
+    Groups are loaded when a message asks for them and unloaded after
+    IDLE_TURNS turns without being asked for again. The tool set only
+    changes on turns that need a new group, because any change discards
+    the reply generated preemptively for that turn.
+    """
+
+    def __init__(self, idle_turns: int = IDLE_TURNS):
+        self.idle_turns = idle_turns
+        self.active = set()
+        self._turn = 0
+        self._last_needed = {}
+
+    def next_turn(self, text: str):
+        """
+        Routes a new user message.
+
+        Returns:
+            The new set of active groups, or None if it did not change.
+        """
+        self._turn += 1
+        needed = route(text)
+        for group in needed:
+            self._last_needed[group] = self._turn
+        if needed <= self.active:
+            return None
+        self.active = {
+            group
+            for group, turn in self._last_needed.items()
+            if self._turn - turn <= self.idle_turns
+        }
+        return self.active
+
+    def enable(self, group: str):
+        """Loads a group on request of the LLM, returns the new active groups."""
+        if group not in TOOL_GROUPS:
+            raise ValueError(f"Unknown tool group '{group}'")
+        self._last_needed[group] = self._turn
+        self.active = self.active | {group}
+        return self.active
+
+
+def tool_names(groups) -> list:
+    """Returns the names of the tools to load for the given groups."""
+    return ALWAYS_ON + [name for group in sorted(groups) for name in TOOL_GROUPS[group]]
@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from typing import Optional
+
+import aiohttp
+from livekit import rtc
+from livekit.agents import NOT_GIVEN, inference
+
+logger = logging.getLogger("tts_cache")
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+# Text file listing the phrases to synthesize at prewarm, one per line.
+TTS_CACHE_PHRASES = os.getenv("TTS_CACHE_PHRASES", "tts_phrases.txt")
+# Seconds prewarm may spend synthesizing missing phrases.
+PREWARM_BUDGET = 6.0
+# Only utterances up to this length are considered for caching.
+MAX_CACHED_CHARS = 160
+# An utterance heard this many times gets cached the next time it is spoken.
+MIN_HITS = 2
+MAX_TRACKED = 1000
+FRAME_MS = 20
+
+# magic, sample rate, number of channels
+HEADER = struct.Struct("<4sIH")
+MAGIC = b"TTSC"
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def load_phrases(path: str = TTS_CACHE_PHRASES) -> list:
+    """Returns the phrases configured for prewarm, if the phrase file exists."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [normalize(line) for line in f if line.strip()]
+
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized audio.
+
+    Entries are keyed by TTS model and voice, language and text, and stored
+    on disk as raw 16-bit PCM that is memory-mapped when played, so worker
+    processes share the pages instead of each holding a copy. Phrases are
+    added at prewarm from the configured list, and on demand once an
+    utterance has been heard MIN_HITS times.
+    """
+
+    def __init__(
+        self, model: str, language: Optional[str] = None, directory: str = TTS_CACHE_DIR
+    ):
+        self.model = model
+        self.language = language or ""
+        self.directory = directory
+        self._maps = {}
+        self._known = {}
+        self._hits = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        self._load_index()
+
+    def _key(self, text: str) -> str:
+        data = "\0".join((self.model, self.language, normalize(text)))
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pcm")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        with self._lock:
+            self._known = {
+                text: key
+                for key, text in index.items()
+                if key == self._key(text) and os.path.exists(self._path(key))
+            }
+
+    def __contains__(self, text: str) -> bool:
+        return normalize(text) in self._known
+
+    def may_match(self, prefix: str) -> bool:
+        """Returns True if the text starting with `prefix` could still be a cached utterance."""
+        prefix = normalize(prefix)
+        with self._lock:
+            candidates = list(self._known)
+        return any(text.startswith(prefix) for text in candidates)
+
+    def record_hit(self, text: str) -> bool:
+        """Counts one more occurrence of an utterance; returns True if it should now be stored."""
+        text = normalize(text)
+        if not text or len(text) > MAX_CACHED_CHARS or text in self._known:
+            return False
+        with self._lock:
+            self._hits[text] = self._hits.get(text, 0) + 1
+            if len(self._hits) > MAX_TRACKED:
+                rarest = min(self._hits, key=self._hits.get)
+                del self._hits[rarest]
+            return self._hits.get(text, 0) > MIN_HITS
+
+    def frames(self, text: str):
+        """Returns the cached audio frames of the text, or None on a miss."""
+        key = self._known.get(normalize(text))
+        if key is None:
+            return None
+        with self._lock:
+            mapped = self._maps.get(key)
+            if mapped is None:
+                with open(self._path(key), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[key] = mapped
+        magic, sample_rate, num_channels = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            return None
+        samples_per_frame = sample_rate * FRAME_MS // 1000
+        frame_bytes = samples_per_frame * num_channels * 2
+        return self._iter_frames(mapped, sample_rate, num_channels, frame_bytes)
+
+    @staticmethod
+    def _iter_frames(mapped, sample_rate, num_channels, frame_bytes):
+        for offset in range(HEADER.size, len(mapped), frame_bytes):
+            data = mapped[offset : offset + frame_bytes]
+            yield rtc.AudioFrame(
+                data=data,
+                sample_rate=sample_rate,
+                num_channels=num_channels,
+                samples_per_channel=len(data) // (2 * num_channels),
+            )
+
+    def store(self, text: str, frames: list):
+        """Writes the audio of an utterance to the cache."""
+        text = normalize(text)
+        if not frames:
+            return
+        key = self._key(text)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, frames[0].sample_rate, frames[0].num_channels))
+            for frame in frames:
+                f.write(frame.data.cast("B"))
+        os.replace(tmp, path)
+        with self._lock:
+            self._known[text] = key
+            self._hits.pop(text, None)
+        self._save_index(key, text)
+
+    def _save_index(self, key: str, text: str):
+        # Other processes may have added entries meanwhile, merge with them.
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index[key] = text
+        tmp = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, self._index_path)
+
+    async def fill(self, phrases: list):
+        """Synthesizes and stores the phrases not cached yet."""
+        missing = [phrase for phrase in phrases if phrase not in self]
+        if not missing:
+            return
+        model, _, voice = self.model.partition(":")
+        async with aiohttp.ClientSession() as http:
+            engine = inference.TTS(model, voice=voice or NOT_GIVEN, http_session=http)
+            for phrase in missing:
+                frames = [ev.frame async for ev in engine.synthesize(phrase)]
+                await asyncio.to_thread(self.store, phrase, frames)
+                logger.info(f"Cached TTS audio for '{phrase}'")
+
+
+def prewarm(model: str, language: Optional[str] = None) -> TTSCache:
+    """Opens the cache of a TTS model and fills it with the configured phrases."""
+    cache = TTSCache(model, language)
+    phrases = load_phrases()
+    if phrases:
+        try:
+            asyncio.run(asyncio.wait_for(cache.fill(phrases), PREWARM_BUDGET))
+        except Exception as e:
+            logger.warning(f"Could not fill the TTS cache at prewarm: {e!r}")
+    return cache
+
+
+async def cached_tts_node(cache: TTSCache, text, synthesize):
+    """
+    tts_node serving cached utterances without calling the TTS.
+
+    Text is only held back while it may still be a cached utterance; anything else is streamed to `synthesize` right away, so
+    replies that cannot hit the cache get no extra latency.
+
+    Args:
+        cache: The TTSCache of the session's TTS.
+        text: The text stream given to Agent.tts_node.
+        synthesize: Function turning a text stream into audio frames,
+            usually the default Agent.tts_node.
+    """
+    chunks = []
+    stream = text.__aiter__()
+    ended = False
+    while True:
+        try:
+            chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            ended = True
+            break
+        chunks.append(chunk)
+        if not cache.may_match("".join(chunks)):
+            break
+
+    full_text = "".join(chunks)
+    if ended:
+        frames = cache.frames(full_text)
+        if frames is not None:
+            logger.info(f"TTS cache hit for '{normalize(full_text)}'")
+            for frame in frames:
+                yield frame
+            return
+
+    async def replay():
+        for chunk in chunks:
+            yield chunk
+        if not ended:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+
+    collected = []
+    async for frame in synthesize(replay()):
+        collected.append(frame)
+        yield frame
+    full_text = "".join(chunks)
+    if cache.record_hit(full_text):
+        await asyncio.to_thread(cache.store, full_text, collected)
@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import dataclasses
+import json
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from typing import Optional
+
+import psutil
+from livekit.agents import WorkerOptions
+
+logger = logging.getLogger("worker_load")
+
+# Directory where job processes report their prewarm time and event-loop lag,
+# one file per process.
+WORKER_LOAD_DIR = os.getenv("WORKER_LOAD_DIR", "worker_load")
+# Arrival times and process costs seen by earlier runs of the worker.
+WORKER_STATS_PATH = os.getenv("WORKER_STATS_PATH", "worker_stats.json")
+# Sessions a host may run at once, by default two per CPU.
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 2 * (os.cpu_count() or 1)))
+# Load above which the worker stops accepting new rooms, in production.
+LOAD_THRESHOLD = float(os.getenv("LOAD_THRESHOLD", 0.8))
+# Event-loop lag of a job at which audio starts to stutter.
+MAX_EVENT_LOOP_LAG = 0.2
+# Share of the host memory job processes may use.
+MEMORY_BUDGET = 0.9
+LAG_INTERVAL = 0.5
+LAG_WINDOW = 10
+# Lag reports older than this come from stuck or finished jobs and are ignored.
+STALE_REPORT = 10
+ARRIVAL_WINDOW = 3600
+# Seconds it takes to start and prewarm a process, until measured.
+DEFAULT_WARMUP = 10.0
+MAX_IDLE_PROCESSES = os.cpu_count() or 1
+SAVE_INTERVAL = 60
+
+_report = {}
+
+
+def _report_path(pid: int) -> str:
+    return os.path.join(WORKER_LOAD_DIR, f"{pid}.json")
+
+
+def report(**fields):
+    """Publishes measurements of this job process to the worker."""
+    _report.update(fields, time=time.time())
+    os.makedirs(WORKER_LOAD_DIR, exist_ok=True)
+    path = _report_path(os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(_report, f)
+    os.replace(tmp, path)
+
+
+def clear_report():
+    with contextlib.suppress(OSError):
+        os.remove(_report_path(os.getpid()))
+
+
+async def monitor_event_loop(interval: float = LAG_INTERVAL):
+    """
+    Measures how late the running event loop wakes up and reports it.
+
+    A loop busy with CPU-bound work, or a host short of CPU, delays audio
+    frames; the lag shows it before the CPU average does.
+    """
+    samples = []
+    try:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            samples.append(max(time.monotonic() - start - interval, 0.0))
+            del samples[: -int(LAG_WINDOW / interval)]
+            lag = sorted(samples)[int(len(samples) * 0.9)]
+            await asyncio.to_thread(report, lag=lag)
+    finally:
+        clear_report()
+
+
+class WorkerLoad:
+    """
+    Load function of the worker, passed as WorkerOptions.load_fnc.
+
+    The load is the highest of four ratios, each 1.0 when the host is full:
+    active sessions against MAX_SESSIONS, CPU usage, the median event-loop
+    lag reported by the jobs against MAX_EVENT_LOOP_LAG, and the memory the
+    host would use with one more job process, which usually runs out first
+    on small hosts.
+
+    It also records the arrival of new jobs and the cost of processes, which
+    idle_processes uses to size the warm pool on the next start.
+    """
+
+    def __init__(self, stats_path: str = WORKER_STATS_PATH):
+        self.stats_path = stats_path
+        self._lock = threading.Lock()
+        self._cpu = []
+        self._seen_jobs = set()
+        self._last_save = time.monotonic()
+        self.stats = load_stats(stats_path)
+
+    def __call__(self, worker) -> float:
+        jobs = [info.job.id for info in worker.active_jobs]
+        self._record_arrivals(jobs)
+        load = self.compute(len(jobs))
+        if time.monotonic() - self._last_save > SAVE_INTERVAL:
+            self.save()
+        return load
+
+    def compute(self, active_sessions: int) -> float:
+        self._cpu.append(psutil.cpu_percent(interval=None) / 100)
+        del self._cpu[:-5]
+        cpu = sum(self._cpu) / len(self._cpu)
+
+        sessions = active_sessions / MAX_SESSIONS
+
+        sizes = {}
+        for child in psutil.Process().children(recursive=True):
+            try:
+                sizes[child.pid] = child.memory_info().rss
+            except psutil.Error:
+                continue
+        if sizes:
+            self.stats["process_memory"] = int(statistics.median(sizes.values()))
+
+        reports = _read_reports(sizes)
+        fresh = time.time() - STALE_REPORT
+        lags = [r["lag"] for r in reports if "lag" in r and r["time"] >= fresh]
+        lag = statistics.median(lags) / MAX_EVENT_LOOP_LAG if lags else 0.0
+        warmups = [r["prewarm"] for r in reports if "prewarm" in r]
+        if warmups:
+            self.stats["warmup"] = max(warmups)
+        # RSS counts the pages processes share, what a new one costs is its USS
+        private = [r["uss"] * 2**20 for r in reports if r.get("uss")]
+        if private:
+            self.stats["process_memory"] = int(statistics.median(private))
+
+        memory = psutil.virtual_memory()
+        used = memory.total - memory.available + self.stats.get("process_memory", 0)
+        memory_load = used / (memory.total * MEMORY_BUDGET)
+
+        return max(sessions, cpu, lag, memory_load)
+
+    def _record_arrivals(self, jobs: list):
+        now = time.time()
+        with self._lock:
+            for job_id in jobs:
+                if job_id not in self._seen_jobs:
+                    self.stats["arrivals"].append(now)
+            self._seen_jobs = set(jobs)
+
+    def save(self):
+        """Writes the arrivals and process costs for the next start of the worker."""
+        self._last_save = time.monotonic()
+        since = time.time() - ARRIVAL_WINDOW
+        with self._lock:
+            self.stats["arrivals"] = [t for t in self.stats["arrivals"] if t >= since]
+            data = dict(self.stats)
+        tmp = f"{self.stats_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.stats_path)
+
+
+def _read_reports(pids) -> list:
+    """Returns the reports of the given processes, removing those of dead ones."""
+    reports = []
+    try:
+        names = os.listdir(WORKER_LOAD_DIR)
+    except OSError:
+        return reports
+    for name in names:
+        pid, _, extension = name.partition(".")
+        if extension != "json" or not pid.isdigit():
+            continue
+        path = os.path.join(WORKER_LOAD_DIR, name)
+        if int(pid) not in pids:
+            if not psutil.pid_exists(int(pid)):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            continue
+        try:
+            with open(path) as f:
+                reports.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return reports
+
+
+def load_stats(path: str = WORKER_STATS_PATH) -> dict:
+    try:
+        with open(path) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = {}
+    stats.setdefault("arrivals", [])
+    return stats
+
+
+def idle_processes(stats: Optional[dict] = None) -> int:
+    """
+    Returns the number of warm processes to keep for the recent arrival rate.
+
+    By Little's law, the processes being warmed up at any time are the
+    arrival rate times the warm-up time; that many must be ready to absorb a
+    burst without a cold start. The peak rate of any minute of the last hour
+    is used, so bursts are covered, and the pool never takes more memory
+    than the host has left.
+
+    The worker shrinks the pool further as its load grows, but cannot grow
+    it above this number while running, so it is computed at start.
+    Without any recorded arrival, 1 is returned.
+    """
+    stats = stats if stats is not None else load_stats()
+    since = time.time() - ARRIVAL_WINDOW
+    per_minute = {}
+    for arrival in stats["arrivals"]:
+        if arrival >= since:
+            minute = int(arrival // 60)
+            per_minute[minute] = per_minute.get(minute, 0) + 1
+    if not per_minute:
+        return 1
+
+    peak_rate = max(per_minute.values()) / 60
+    warmup = stats.get("warmup", DEFAULT_WARMUP)
+    needed = math.ceil(peak_rate * warmup) + 1
+
+    process_memory = stats.get("process_memory")
+    if process_memory:
+        spare = psutil.virtual_memory().available - psutil.virtual_memory().total * (1 - MEMORY_BUDGET)
+        needed = min(needed, max(int(spare // process_memory), 1))
+    return max(1, min(needed, MAX_IDLE_PROCESSES))
+
+
+def worker_options() -> dict:
+    """
+    Returns the load_threshold and num_idle_processes options of the worker.
+
+    Both only change LiveKit's production defaults: dev runs keep accepting
+    every room with no warm pool. The warm pool is never made smaller than
+    LiveKit's default, which a host without arrival history, such as a new
+    container, falls back to.
+    """
+    defaults = WorkerOptions.__dataclass_fields__
+    threshold = defaults["load_threshold"].default
+    idle = defaults["num_idle_processes"].default
+    return {
+        "load_threshold": dataclasses.replace(threshold, prod_default=LOAD_THRESHOLD),
+        "num_idle_processes": dataclasses.replace(
+            idle, prod_default=max(idle.prod_default, idle_processes())
+        ),
+    }
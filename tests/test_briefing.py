@@ -0,0 +1,43 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+from briefing import get_briefing
+
+
+@pytest.mark.asyncio
+async def test_briefing_merges_sources() -> None:
+    with (
+        patch("briefing.get_upcoming_events", return_value="Evenements à venir:\n10:00 - Standup\n"),
+        patch("briefing.list_unread_emails", return_value="From: Alice\nSubject: Hi\nLabels: ['UNREAD']"),
+        patch("briefing.list_open_tasks", return_value="Open tasks:\n- Buy milk (Groceries)\n"),
+    ):
+        result = await get_briefing()
+
+    assert result == (
+        "Evenements à venir:\n10:00 - Standup\n\n"
+        "Unread emails:\nFrom: Alice\nSubject: Hi\n\n"
+        "Open tasks:\n- Buy milk (Groceries)"
+    )
+
+
+@pytest.mark.asyncio
+async def test_briefing_respects_budget() -> None:
+    def slow_tasks(n):
+        time.sleep(1)
+        return "Open tasks:\n- Too late\n"
+
+    with (
+        patch("briefing.get_upcoming_events", return_value=None),
+        patch("briefing.list_unread_emails", return_value=""),
+        patch("briefing.list_open_tasks", side_effect=slow_tasks),
+    ):
+        started = time.monotonic()
+        result = await get_briefing(budget=0.2)
+
+    assert time.monotonic() - started < 0.5
+    assert result == (
+        "No upcoming events.\n\nNo unread emails.\n\n"
+        "The tasks could not be checked in time."
+    )
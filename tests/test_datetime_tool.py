@@ -0,0 +1,65 @@
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from datetime_tool import describe_now, resolve_datetime, resolve_end
+
+PARIS = ZoneInfo("Europe/Paris")
+# A Wednesday afternoon
+NOW = dt.datetime(2025, 10, 15, 14, 20, tzinfo=PARIS)
+
+
+@pytest.mark.parametrize(
+    ("expression", "expected"),
+    [
+        ("tomorrow at 3", dt.datetime(2025, 10, 16, 15, 0)),
+        ("tomorrow at 9am", dt.datetime(2025, 10, 16, 9, 0)),
+        ("in two hours", dt.datetime(2025, 10, 15, 16, 20)),
+        ("in 30 minutes", dt.datetime(2025, 10, 15, 14, 50)),
+        ("next Friday", dt.datetime(2025, 10, 17, 9, 0)),
+        ("next Tuesday at noon", dt.datetime(2025, 10, 21, 12, 0)),
+        ("wednesday at 10:30", dt.datetime(2025, 10, 22, 10, 30)),
+        ("this wednesday evening", dt.datetime(2025, 10, 15, 19, 0)),
+        ("at 11", dt.datetime(2025, 10, 16, 11, 0)),
+        ("tonight", dt.datetime(2025, 10, 15, 20, 0)),
+        ("the day after tomorrow at 8 in the evening", dt.datetime(2025, 10, 17, 20, 0)),
+        ("March 3rd at 15:30", dt.datetime(2026, 3, 3, 15, 30)),
+        ("25 december 2025 at 7pm", dt.datetime(2025, 12, 25, 19, 0)),
+        ("2025-11-02T08:00:00", dt.datetime(2025, 11, 2, 8, 0)),
+    ],
+)
+def test_resolve_datetime(expression, expected) -> None:
+    resolved = resolve_datetime(expression, current=NOW)
+    assert resolved == expected.replace(tzinfo=PARIS)
+    assert resolved.tzinfo is not None
+
+
+@pytest.mark.parametrize(
+    ("start", "end", "expected"),
+    [
+        ("friday at 3pm", "4:30pm", dt.datetime(2025, 10, 17, 16, 30)),
+        ("tomorrow at 3pm", "tomorrow at 5pm", dt.datetime(2025, 10, 16, 17, 0)),
+        ("friday at 3pm", "friday at 5pm", dt.datetime(2025, 10, 17, 17, 0)),
+    ],
+)
+def test_resolve_end(start, end, expected) -> None:
+    start = resolve_datetime(start, current=NOW)
+    assert resolve_end(end, start, current=NOW) == expected.replace(tzinfo=PARIS)
+
+
+def test_end_before_start() -> None:
+    start = resolve_datetime("tomorrow at 3pm", current=NOW)
+    with pytest.raises(ValueError):
+        resolve_end("2pm", start, current=NOW)
+
+
+def test_unknown_expression() -> None:
+    with pytest.raises(ValueError):
+        resolve_datetime("whenever you like", current=NOW)
+
+
+def test_describe_now() -> None:
+    assert describe_now(NOW) == (
+        "Current date and time: Wednesday 2025-10-15 14:20 (Europe/Paris, UTC+0200)."
+    )
@@ -0,0 +1,98 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import google_api
+from google_api import CircuitBreaker, GoogleApiUnavailableError, execute
+from google_quota import QuotaScheduler
+
+
+def _http_error(status, **headers):
+    return HttpError(httplib2.Response({"status": status, **headers}), b"error")
+
+
+def _request(*results):
+    request = MagicMock()
+    request.http.credentials = None
+    request.execute.side_effect = list(results)
+    return request
+
+
+@patch("google_api.time.sleep", lambda _: None)
+class TestGoogleApi(unittest.TestCase):
+    def setUp(self):
+        google_api._breakers.clear()
+        google_api._cache.clear()
+        google_api._turn_deadline = None
+        self.scheduler = QuotaScheduler()
+        patcher = patch("google_api.scheduler", self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_transient_errors(self):
+        request = _request(_http_error(503), {"items": []})
+        self.assertEqual(execute(request, "tasks"), {"items": []})
+        self.assertEqual(request.execute.call_count, 2)
+
+    def test_does_not_retry_client_errors(self):
+        request = _request(_http_error(404))
+        with self.assertRaises(HttpError):
+            execute(request, "tasks")
+        self.assertEqual(request.execute.call_count, 1)
+
+    def test_does_not_retry_failed_writes(self):
+        request = _request(_http_error(500), {"id": "1"})
+        with self.assertRaises(HttpError):
+            execute(request, "gmail", idempotent=False)
+        self.assertEqual(request.execute.call_count, 1)
+
+    def test_rate_limit_throttles_scheduler(self):
+        request = _request(_http_error(429, **{"retry-after": "0"}), {"items": []})
+        self.assertEqual(execute(request, "gmail"), {"items": []})
+        bucket = self.scheduler._buckets[("me", "gmail")]
+        self.assertLess(bucket.rate, bucket.max_rate)
+        self.assertEqual(google_api.get_breaker("gmail").state, CircuitBreaker.CLOSED)
+
+    def test_long_retry_after_does_not_open_the_circuit(self):
+        for _ in range(google_api.CircuitBreaker().failure_threshold + 1):
+            request = _request(_http_error(429, **{"retry-after": "30"}))
+            with self.assertRaises((HttpError, GoogleApiUnavailableError)):
+                execute(request, "gmail", deadline=0.2)
+        self.assertEqual(google_api.get_breaker("gmail").state, CircuitBreaker.CLOSED)
+
+    @patch("google_api.HEDGE_AFTER", 0.05)
+    def test_hedge_needs_a_quota_token(self):
+        scheduler = QuotaScheduler({"tasks": (0.001, 1)})
+        slow = threading.Event()
+        request = _request()
+        request.execute.side_effect = lambda: slow.wait(0.3) or {"items": []}
+        with patch("google_api.scheduler", scheduler):
+            self.assertEqual(execute(request, "tasks"), {"items": []})
+        self.assertEqual(request.execute.call_count, 1)
+
+    def test_open_circuit_serves_cached_reads(self):
+        execute(_request({"items": ["a"]}), "calendar", cache_key="upcoming")
+        google_api.get_breaker("calendar")._opened_at = google_api.time.monotonic()
+
+        request = _request({"items": ["b"]})
+        self.assertEqual(
+            execute(request, "calendar", cache_key="upcoming"), {"items": ["a"]}
+        )
+        request.execute.assert_not_called()
+        with self.assertRaises(GoogleApiUnavailableError):
+            execute(request, "calendar")
+
+    def test_circuit_opens_after_repeated_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
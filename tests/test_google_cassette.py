@@ -0,0 +1,119 @@
+import base64
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import google_api
+import google_calendar_tool
+import google_mail_tool
+from google_cassette import Cassette, CassetteMissError, Sanitizer
+from google_quota import QuotaScheduler
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "google_cassette.json")
+
+
+def _request(method, uri, body=None):
+    request = MagicMock()
+    request.method, request.uri, request.body = method, uri, body
+    return request
+
+
+class TestReplay(unittest.TestCase):
+    """Runs the tools against recorded Gmail and Calendar traffic, offline."""
+
+    def setUp(self):
+        google_api._breakers.clear()
+        google_api._cache.clear()
+        google_api._turn_deadline = None
+        for target, value in (
+            ("google_api.scheduler", QuotaScheduler()),
+            ("google_auth.replaying", lambda: True),
+        ):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _replay(self, latency_scale):
+        cassette = Cassette(FIXTURE, "replay", latency_scale)
+        patcher = patch("google_api.get_cassette", lambda: cassette)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return cassette
+
+    def test_unread_emails(self):
+        self._replay(0)
+        self.assertEqual(
+            google_mail_tool.list_unread_emails(2),
+            "ID: anon000000000001\nFrom: person1@example.invalid\nSubject: Design review\nLabels: ['UNREAD', 'INBOX']\n---\n"
+            "ID: anon000000000002\nFrom: person3@example.invalid\nSubject: Order shipped\n"
+            "Labels: ['UNREAD', 'CATEGORY_UPDATES', 'INBOX']",
+        )
+
+    def test_replay_does_not_depend_on_the_clock(self):
+        self._replay(0)
+        result = google_calendar_tool.get_upcoming_events(2)
+        self.assertIn("2025-03-06T10:00:00+01:00 - Design review", result)
+        self.assertIn("Dentist", result)
+
+    def test_recorded_latency_is_replayed(self):
+        self._replay(0.5)
+        started = time.monotonic()
+        google_mail_tool.list_unread_emails(2)
+        # 0.142 + 0.096 + 0.088 seconds recorded
+        self.assertGreaterEqual(time.monotonic() - started, 0.163)
+
+    def test_slower_than_timeout_times_out(self):
+        cassette = self._replay(1)
+        request = _request("GET", "https://gmail.googleapis.com/gmail/v1/users/me/messages?q=is%3Aunread&maxResults=2&alt=json")
+        with self.assertRaises(TimeoutError):
+            cassette.run(request, 0.01, None)
+
+    def test_unknown_request_is_a_miss(self):
+        cassette = self._replay(0)
+        with self.assertRaises(CassetteMissError):
+            cassette.run(_request("GET", "https://gmail.googleapis.com/gmail/v1/users/me/labels"), 1, None)
+
+
+class TestRecord(unittest.TestCase):
+    def test_addresses_and_ids_are_replaced_consistently(self):
+        sanitizer = Sanitizer()
+        self.assertEqual(
+            sanitizer.uri("https://gmail.googleapis.com/gmail/v1/users/me/messages/18c2f3a4b5c6d7e8?alt=json"),
+            "/gmail/v1/users/me/messages/anon000000000001?alt=json",
+        )
+        data = sanitizer.data({
+            "id": "18c2f3a4b5c6d7e8",
+            "nextPageToken": "secret",
+            "headers": [{"name": "From", "value": "Alice <alice@corp.example.com>"}],
+            "snippet": "ping alice@corp.example.com",
+        })
+        self.assertEqual(data, {
+            "id": "anon000000000001",
+            "nextPageToken": "token1",
+            "headers": [{"name": "From", "value": "person1@example.invalid"}],
+            "snippet": "ping person1@example.invalid",
+        })
+
+    def test_records_sanitized_exchanges(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "cassette.json")
+        cassette = Cassette(path, "record")
+        raw = base64.urlsafe_b64encode(b"To: bob@corp.example.com\n\nHi").decode()
+        request = _request("POST", "https://gmail.googleapis.com/gmail/v1/users/me/messages/send?alt=json", json.dumps({"raw": raw}))
+        result = cassette.run(request, 1, lambda request, timeout: {"id": "18c2f3a4b5c6d7e8"})
+        self.assertEqual(result, {"id": "18c2f3a4b5c6d7e8"})
+        cassette.save()
+
+        with open(path) as f:
+            [interaction] = json.load(f)["interactions"]
+        self.assertIn("person1@example.invalid", interaction["request"])
+        self.assertNotIn("bob", interaction["request"])
+        self.assertEqual(interaction["response"], {"id": "anon000000000001"})
+
+
+if __name__ == "__main__":
+    unittest.main()
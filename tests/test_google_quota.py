@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from google_quota import BACKGROUND, INTERACTIVE, QuotaScheduler
+
+
+class TestQuotaScheduler(unittest.TestCase):
+    def test_burst_then_queue(self):
+        scheduler = QuotaScheduler({"tasks": (100.0, 2)})
+        self.assertTrue(scheduler.acquire("me", "tasks"))
+        self.assertTrue(scheduler.acquire("me", "tasks"))
+        self.assertFalse(scheduler.acquire("me", "tasks", timeout=0))
+        self.assertTrue(scheduler.acquire("me", "tasks", timeout=1))
+
+    def test_users_have_separate_buckets(self):
+        scheduler = QuotaScheduler({"tasks": (1.0, 1)})
+        self.assertTrue(scheduler.acquire("alice", "tasks", timeout=0))
+        self.assertTrue(scheduler.acquire("bob", "tasks", timeout=0))
+        self.assertFalse(scheduler.acquire("alice", "tasks", timeout=0))
+
+    def test_interactive_requests_go_first(self):
+        scheduler = QuotaScheduler({"gmail": (20.0, 1)})
+        scheduler.acquire("me", "gmail")
+        order = []
+
+        def run(name, priority):
+            scheduler.acquire("me", "gmail", priority)
+            order.append(name)
+
+        background = threading.Thread(target=run, args=("background", BACKGROUND))
+        background.start()
+        time.sleep(0.01)
+        interactive = threading.Thread(target=run, args=("interactive", INTERACTIVE))
+        interactive.start()
+        background.join()
+        interactive.join()
+        self.assertEqual(order, ["interactive", "background"])
+
+    def test_throttle_honors_retry_after(self):
+        scheduler = QuotaScheduler({"calendar": (100.0, 5)})
+        scheduler.throttle("me", "calendar", retry_after=0.2)
+        self.assertFalse(scheduler.acquire("me", "calendar", timeout=0.1))
+        self.assertTrue(scheduler.acquire("me", "calendar", timeout=0.5))
+
+    def test_processes_share_the_buckets(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "google_quota.sqlite3")
+        first = QuotaScheduler({"tasks": (1.0, 2)}, path)
+        second = QuotaScheduler({"tasks": (1.0, 2)}, path)
+
+        self.assertTrue(first.acquire("me", "tasks", timeout=0))
+        self.assertTrue(second.acquire("me", "tasks", timeout=0))
+        self.assertFalse(first.acquire("me", "tasks", timeout=0))
+        self.assertFalse(second.acquire("me", "tasks", timeout=0))
+
+        first.throttle("me", "tasks", retry_after=60)
+        self.assertFalse(second.acquire("me", "tasks", timeout=0.1))
+        self.assertLess(second._buckets[("me", "tasks")].rate, 1.0)
+        self.assertTrue(second.acquire("me", "calendar", timeout=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
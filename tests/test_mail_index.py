@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from mail_index import MailIndex
+
+
+def _message(message_id, sender, subject, snippet, date):
+    return {
+        "id": message_id,
+        "snippet": snippet,
+        "internalDate": str(date),
+        "labelIds": ["INBOX"],
+        "payload": {
+            "headers": [
+                {"name": "From", "value": sender},
+                {"name": "Subject", "value": subject},
+            ]
+        },
+    }
+
+
+MESSAGES = {
+    "1": _message("1", "Alice <alice@example.com>", "Invoice for March", "Please find the invoice", 3),
+    "2": _message("2", "Bob <bob@example.com>", "Lunch", "Are you free on Friday?", 2),
+    "3": _message("3", "Alice <alice@example.com>", "Holidays", "Pictures from the beach", 1),
+    "4": _message("4", "Carol <carol@example.com>", "Facture", "Votre facture de mai", 4),
+}
+
+
+class TestMailIndex(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = MailIndex(os.path.join(directory.name, "index.sqlite3"))
+
+        self.service = MagicMock()
+        users = self.service.users()
+        users.getProfile().execute.return_value = {"historyId": "100"}
+        users.messages().list().execute.return_value = {
+            "messages": [{"id": "1"}, {"id": "2"}, {"id": "3"}]
+        }
+        users.messages().get.side_effect = lambda **kwargs: MagicMock(
+            **{"execute.return_value": MESSAGES[kwargs["id"]]}
+        )
+
+    def test_search_ranks_matches(self):
+        self.assertEqual(self.index.sync(self.service), 3)
+
+        results = self.index.search("alice invoice")
+        self.assertEqual([r["id"] for r in results], ["1"])
+
+        results = self.index.search("alice")
+        self.assertCountEqual([r["id"] for r in results], ["1", "3"])
+
+        self.assertEqual(self.index.search("nothing matches this"), [])
+
+    def test_incremental_sync(self):
+        self.index.sync(self.service)
+        self.service.users().history().list().execute.return_value = {
+            "historyId": "101",
+            "history": [
+                {"messagesAdded": [{"message": {"id": "4"}}]},
+                {"messagesDeleted": [{"message": {"id": "2"}}]},
+            ],
+        }
+
+        self.assertEqual(self.index.sync(self.service), 2)
+        self.assertEqual([r["id"] for r in self.index.search("facture")], ["4"])
+        self.assertEqual(self.index.search("lunch"), [])
+        self.assertEqual(self.index._get_meta("history_id"), "101")
+
+    @patch("mail_index.LEASE_RENEWAL", 2)
+    def test_full_sync_resumes_after_a_failure(self):
+        fetch = self.index._fetch
+
+        def failing_fetch(service, message_id):
+            if message_id == "3":
+                raise OSError("connection reset")
+            return fetch(service, message_id)
+
+        with patch.object(self.index, "_fetch", failing_fetch), self.assertRaises(OSError):
+            self.index.sync(self.service)
+        # The first batch was kept, but the index is not marked as built yet
+        self.assertEqual([r["id"] for r in self.index.search("lunch")], ["2"])
+        self.assertFalse(self.index.ready())
+
+        self.assertEqual(self.index.sync(self.service), 1)
+        self.assertTrue(self.index.ready())
+        self.assertEqual([r["id"] for r in self.index.search("beach")], ["3"])
+
+    def test_one_process_synchronizes_at_a_time(self):
+        other = MailIndex(self.index.path)
+        self.assertTrue(self.index._take_lease())
+        self.assertFalse(other._take_lease())
+        # The holder renews its lease, the others wait for it to be released
+        self.assertTrue(self.index._take_lease())
+        self.index._release_lease()
+        self.assertTrue(other._take_lease())
+
+    def test_ready_after_the_first_sync(self):
+        self.assertFalse(self.index.ready())
+        self.index.sync(self.service)
+        self.assertTrue(self.index.ready())
+
+
+if __name__ == "__main__":
+    unittest.main()
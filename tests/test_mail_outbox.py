@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from google_api import GoogleApiUnavailableError
+from mail_outbox import DEDUP_WINDOW, FAILED, PENDING, SENT, UNKNOWN, MailOutbox
+
+
+@patch("mail_outbox.authenticate_google", MagicMock())
+@patch("mail_outbox.build", MagicMock())
+class TestMailOutbox(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.outbox = MailOutbox(os.path.join(directory.name, "outbox.sqlite3"))
+        self.statuses = []
+        self.outbox.on_status(self.statuses.append)
+
+    def _status(self, email_id):
+        with self.outbox._connect() as db:
+            return db.execute(
+                "SELECT status FROM outbox WHERE id = ?", (email_id,)
+            ).fetchone()[0]
+
+    @patch("mail_outbox.deliver_email")
+    def test_enqueue_then_deliver(self, mock_deliver):
+        mock_deliver.return_value = {"id": "abc"}
+
+        email_id, duplicate = self.outbox.enqueue("a@example.com", "Hi", "Hello")
+        self.assertFalse(duplicate)
+        self.assertEqual(self._status(email_id), PENDING)
+        mock_deliver.assert_not_called()
+
+        self.assertEqual(self.outbox.flush(), 1)
+        self.assertEqual(self._status(email_id), SENT)
+        self.assertEqual(self.statuses[0]["status"], SENT)
+        self.assertEqual(self.outbox.flush(), 0)
+
+    def test_duplicates_are_not_queued_twice(self):
+        first, _ = self.outbox.enqueue("a@example.com", "Hi", "Hello")
+        second, duplicate = self.outbox.enqueue("A@example.com ", "Hi", "Hello")
+        self.assertTrue(duplicate)
+        self.assertEqual(first, second)
+
+    @patch("mail_outbox.deliver_email")
+    def test_transient_failures_are_retried_later(self, mock_deliver):
+        for error in (
+            ConnectionRefusedError("connection refused"),
+            HttpError(httplib2.Response({"status": 429}), b"slow down"),
+            GoogleApiUnavailableError("gmail circuit is open"),
+        ):
+            mock_deliver.side_effect = error
+            email_id, _ = self.outbox.enqueue("a@example.com", "Hi", str(error))
+
+            self.outbox.flush()
+            self.assertEqual(self._status(email_id), PENDING)
+        self.assertEqual(self.statuses, [])
+
+    @patch("mail_outbox.deliver_email")
+    def test_ambiguous_failures_are_not_resent(self, mock_deliver):
+        for error in (
+            OSError("connection reset"),
+            HttpError(httplib2.Response({"status": 503}), b"unavailable"),
+            GoogleApiUnavailableError(
+                "gmail request did not complete in time", maybe_sent=True
+            ),
+        ):
+            mock_deliver.side_effect = error
+            email_id, _ = self.outbox.enqueue("a@example.com", "Hi", str(error))
+
+            self.outbox.flush()
+            self.assertEqual(self._status(email_id), UNKNOWN)
+            self.assertEqual(self.statuses[-1]["status"], UNKNOWN)
+        self.assertEqual(len(self.statuses), 3)
+        self.assertEqual(self.outbox.flush(), 0)
+
+    @patch("mail_outbox.deliver_email")
+    def test_rejected_emails_fail(self, mock_deliver):
+        mock_deliver.side_effect = HttpError(httplib2.Response({"status": 400}), b"bad")
+        email_id, _ = self.outbox.enqueue("not-an-address", "Hi", "Hello")
+
+        self.outbox.flush()
+        self.assertEqual(self._status(email_id), FAILED)
+        self.assertEqual(self.statuses[0]["status"], FAILED)
+
+    @patch("mail_outbox.deliver_email")
+    def test_emails_of_other_sessions_are_left_to_them(self, mock_deliver):
+        mock_deliver.return_value = {"id": "abc"}
+        other = MailOutbox(self.outbox.path)
+        email_id, _ = other.enqueue("a@example.com", "Hi", "Hello")
+
+        self.assertEqual(self.outbox.flush(), 0)
+        self.assertEqual(self._status(email_id), PENDING)
+
+        # Once the other session is gone, its emails are still delivered,
+        # but there is nobody left to tell
+        other.stop()
+        self.assertEqual(self.outbox.flush(), 1)
+        self.assertEqual(self._status(email_id), SENT)
+        self.assertEqual(self.statuses, [])
+
+    @patch("mail_outbox.deliver_email")
+    def test_finished_emails_are_purged_after_the_dedup_window(self, mock_deliver):
+        mock_deliver.return_value = {"id": "abc"}
+        self.outbox.enqueue("a@example.com", "Hi", "Hello")
+        self.outbox.flush()
+        pending, _ = self.outbox.enqueue("b@example.com", "Hi", "Hello")
+
+        self.assertEqual(self.outbox.purge(), 0)
+        with self.outbox._connect() as db:
+            db.execute("UPDATE outbox SET created_at = created_at - ?", (DEDUP_WINDOW + 1,))
+        self.assertEqual(self.outbox.purge(), 1)
+        with self.outbox._connect() as db:
+            ids = [row[0] for row in db.execute("SELECT id FROM outbox")]
+        self.assertEqual(ids, [pending])
+
+    @patch("mail_outbox.deliver_email")
+    def test_missing_credentials_fail_the_emails(self, mock_deliver):
+        email_id, _ = self.outbox.enqueue("a@example.com", "Hi", "Hello")
+        with patch("mail_outbox.authenticate_google", return_value=None):
+            self.assertEqual(self.outbox.flush(), 1)
+        self.assertEqual(self._status(email_id), FAILED)
+        self.assertIn("Authentication failed", self.statuses[0]["error"])
+        mock_deliver.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
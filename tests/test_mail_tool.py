@@ -1,7 +1,74 @@
+import base64
 import unittest
 from unittest.mock import MagicMock, patch
 
-from src.google_mail_tool import list_unread_emails
+from src.google_mail_tool import (
+    STRUCTURE_FIELDS,
+    data_fields,
+    decode_body,
+    get_email_attachment,
+    list_unread_emails,
+    read_email,
+    search_emails,
+)
+
+
+def _b64(text, encoding="utf-8"):
+    return base64.urlsafe_b64encode(text.encode(encoding)).decode()
+
+
+STRUCTURE = {
+    "id": "m1",
+    "payload": {
+        "partId": "",
+        "mimeType": "multipart/mixed",
+        "headers": [
+            {"name": "From", "value": "Alice <alice@example.com>"},
+            {"name": "Subject", "value": "Review"},
+            {"name": "Date", "value": "Thu, 6 Mar 2025 10:00:00 +0100"},
+        ],
+        "parts": [
+            {
+                "partId": "0",
+                "mimeType": "multipart/alternative",
+                "parts": [
+                    {
+                        "partId": "0.0",
+                        "mimeType": "text/plain",
+                        "headers": [{"name": "Content-Type", "value": "text/plain; charset=ISO-8859-1"}],
+                        "body": {"size": 28},
+                    },
+                    {"partId": "0.1", "mimeType": "text/html", "body": {"size": 60}},
+                ],
+            },
+            {
+                "partId": "1",
+                "mimeType": "application/pdf",
+                "filename": "slides.pdf",
+                "body": {"size": 25 * 1024 * 1024, "attachmentId": "a1"},
+            },
+            {
+                "partId": "2",
+                "mimeType": "text/plain",
+                "filename": "notes.txt",
+                "body": {"size": 12, "attachmentId": "a2"},
+            },
+        ],
+    },
+}
+DATA = {
+    "payload": {
+        "partId": "",
+        "parts": [
+            {"partId": "0", "parts": [
+                {"partId": "0.0", "body": {"data": _b64("Can we meet at the café?", "latin-1")}},
+                {"partId": "0.1", "body": {"data": _b64("<p>Can we meet?</p>")}},
+            ]},
+            {"partId": "1", "body": {}},
+            {"partId": "2", "body": {}},
+        ],
+    },
+}
 
 
 class TestGoogleMailTool(unittest.TestCase):
@@ -25,9 +92,9 @@ class TestGoogleMailTool(unittest.TestCase):
         mock_service.users().messages().list().execute.return_value = mock_messages
 
         # Mock the message get
-        def get_message(userId, id):
+        def get_message(**kwargs):
             mock_msg = MagicMock()
-            if id == "1":
+            if kwargs["id"] == "1":
                 mock_msg.execute.return_value = {
                     "payload": {
                         "headers": [
@@ -37,7 +104,7 @@ class TestGoogleMailTool(unittest.TestCase):
                     },
                     "labelIds": ["UNREAD", "INBOX"],
                 }
-            elif id == "2":
+            elif kwargs["id"] == "2":
                 mock_msg.execute.return_value = {
                     "payload": {
                         "headers": [
@@ -57,9 +124,129 @@ class TestGoogleMailTool(unittest.TestCase):
         result = list_unread_emails(2)
 
         # Assert the result
-        expected_result = "From: Sender 1\nSubject: Subject 1\nLabels: ['UNREAD', 'INBOX']\n---\nFrom: Sender 2\nSubject: Subject 2\nLabels: ['UNREAD', 'INBOX']"
+        expected_result = "ID: 1\nFrom: Sender 1\nSubject: Subject 1\nLabels: ['UNREAD', 'INBOX']\n---\nID: 2\nFrom: Sender 2\nSubject: Subject 2\nLabels: ['UNREAD', 'INBOX']"
         self.assertEqual(result, expected_result)
 
 
+@patch("src.google_mail_tool.authenticate_google", MagicMock())
+@patch("src.google_mail_tool.build")
+@patch("src.google_mail_tool.get_index")
+class TestSearchEmails(unittest.TestCase):
+    def test_searches_the_index_once_built(self, mock_index, mock_build):
+        mock_index().ready.return_value = True
+        mock_index().search.return_value = [
+            {"id": "1", "sender": "Alice", "subject": "March", "snippet": "Invoice", "date": 1}
+        ]
+        self.assertEqual(search_emails("invoice"), "ID: 1\nFrom: Alice\nSubject: March\nSnippet: Invoice")
+        mock_build.assert_not_called()
+
+    def test_older_emails_are_searched_in_gmail(self, mock_index, mock_build):
+        mock_index().ready.return_value = True
+        mock_index().search.return_value = []
+        mock_build.return_value.users().messages().list().execute.return_value = {}
+        self.assertEqual(search_emails("invoice"), "No email found matching 'invoice'.")
+        mock_build.assert_called_once()
+
+    def test_searches_gmail_while_the_index_is_built(self, mock_index, mock_build):
+        mock_index().ready.return_value = False
+        messages = mock_build.return_value.users().messages()
+        messages.list().execute.return_value = {"messages": [{"id": "1"}]}
+        messages.get().execute.return_value = {
+            "id": "1",
+            "snippet": "Please find the invoice",
+            "payload": {"headers": [{"name": "From", "value": "Alice"}, {"name": "Subject", "value": "March"}]},
+        }
+        self.assertEqual(
+            search_emails("invoice"),
+            "ID: 1\nFrom: Alice\nSubject: March\nSnippet: Please find the invoice",
+        )
+        mock_index().search.assert_not_called()
+
+
+@patch("src.google_mail_tool.authenticate_google", MagicMock())
+@patch("src.google_mail_tool.build")
+class TestReadEmail(unittest.TestCase):
+    def _service(self, mock_build, structure=STRUCTURE, data=DATA):
+        service = MagicMock()
+        mock_build.return_value = service
+
+        def get_message(**kwargs):
+            request = MagicMock()
+            request.execute.return_value = (
+                structure if kwargs["fields"] == STRUCTURE_FIELDS else data
+            )
+            return request
+
+        service.users().messages().get.side_effect = get_message
+        service.users().messages().attachments().get.return_value.execute.return_value = {
+            "data": _b64("Bring coffee")
+        }
+        service.users().messages().attachments().get.reset_mock()
+        return service
+
+    def test_reads_the_plain_text_part_only(self, mock_build):
+        service = self._service(mock_build)
+        result = read_email("m1")
+        self.assertIn("From: Alice <alice@example.com>\nSubject: Review", result)
+        self.assertIn("Can we meet at the café?", result)
+        self.assertIn("- slides.pdf (application/pdf, 25600 KB)", result)
+        # Attachments are never downloaded to read the body, and only the
+        # content of the parts at the depth of the text part is
+        service.users().messages().attachments().get.assert_not_called()
+        service.users().messages().get.assert_called_with(
+            userId="me", id="m1", format="full", fields="payload(parts(parts(partId,body/data)))"
+        )
+        self.assertEqual(data_fields(""), "payload(partId,body/data)")
+
+    def test_html_is_turned_into_speakable_text(self, mock_build):
+        structure = {"id": "m2", "payload": {"partId": "", "mimeType": "text/html", "body": {"size": 100}}}
+        html = "<html><head><style>p {color: red}</style></head><body><p>Hello&nbsp;Bob</p>" \
+            "<script>track()</script><p>See https://example.com/x?y=1</p></body></html>"
+        data = {"payload": {"partId": "", "body": {"data": _b64(html)}}}
+        self._service(mock_build, structure, data)
+        result = read_email("m2")
+        self.assertTrue(result.endswith("\n\nHello Bob\n\nSee (link)"), result)
+
+    def test_large_alternative_parts_are_not_downloaded(self, mock_build):
+        # A newsletter: a short text part next to a large HTML one
+        structure = {"id": "m3", "payload": {"partId": "", "mimeType": "multipart/alternative", "parts": [
+            {"partId": "0", "mimeType": "text/plain", "body": {"size": 1024}},
+            {"partId": "1", "mimeType": "text/html", "body": {"size": 3 * 1024 * 1024}},
+        ]}}
+        service = self._service(mock_build, structure)
+        self.assertTrue(read_email("m3").endswith("The text of this email is too large to be read."))
+        service.users().messages().get.assert_called_once_with(
+            userId="me", id="m3", format="full", fields=STRUCTURE_FIELDS
+        )
+
+    def test_reads_a_text_attachment_by_name(self, mock_build):
+        service = self._service(mock_build)
+        self.assertEqual(get_email_attachment("m1", "notes"), "notes.txt:\nBring coffee")
+        service.users().messages().attachments().get.assert_called_once_with(
+            userId="me", messageId="m1", id="a2"
+        )
+
+    def test_binary_attachments_are_not_downloaded(self, mock_build):
+        service = self._service(mock_build)
+        self.assertIn("cannot be read aloud", get_email_attachment("m1", "slides.pdf"))
+        service.users().messages().attachments().get.assert_not_called()
+
+
+class TestDecodeBody(unittest.TestCase):
+    def test_stops_at_the_byte_cap(self):
+        text, truncated = decode_body(_b64("word " * 200_000), "utf-8", False, 10**9, max_bytes=5000)
+        self.assertTrue(truncated)
+        self.assertLessEqual(len(text), 5000)
+
+    def test_stops_at_the_character_cap(self):
+        text, truncated = decode_body(_b64("é word " * 10_000), "utf-8", False, 100)
+        self.assertTrue(truncated)
+        self.assertLessEqual(len(text), 100)
+        self.assertTrue(text.startswith("é word é"))
+
+    def test_short_body_is_complete(self):
+        self.assertEqual(decode_body(_b64("Hi there"), "utf-8", False, 100), ("Hi there", False))
+
+
 if __name__ == "__main__":
     unittest.main()
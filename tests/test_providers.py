@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from livekit.agents.metrics import EOUMetrics, LLMMetrics
+from livekit.agents.metrics.base import Metadata
+
+from providers import ProviderStats, load_profiles
+
+MODELS = ["openai/gpt-4.1-mini", "google/gemini-2.0-flash", "openai/gpt-4o-mini"]
+
+
+def _llm_metrics(model, ttft):
+    return LLMMetrics(
+        label="llm", request_id="r", timestamp=0, duration=1, ttft=ttft, cancelled=False,
+        completion_tokens=0, prompt_tokens=0, prompt_cached_tokens=0, total_tokens=0,
+        tokens_per_second=0, metadata=Metadata(model_name=model, model_provider="livekit"),
+    )
+
+
+@patch("providers.EXPLORATION_RATE", 0)
+class TestProviderStats(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "stats.json")
+        self.stats = ProviderStats(self.path)
+
+    def test_unmeasured_models_keep_configured_order(self):
+        self.assertEqual(self.stats.rank(MODELS), MODELS)
+
+    def test_fastest_healthy_model_first(self):
+        self.stats.collect(_llm_metrics("openai/gpt-4.1-mini", 1.2))
+        self.stats.collect(_llm_metrics("google/gemini-2.0-flash", 0.4))
+        self.assertEqual(
+            self.stats.rank(MODELS),
+            ["google/gemini-2.0-flash", "openai/gpt-4.1-mini", "openai/gpt-4o-mini"],
+        )
+
+        for _ in range(3):
+            self.stats.record_failure("google/gemini-2.0-flash")
+        self.assertEqual(self.stats.rank(MODELS)[-1], "google/gemini-2.0-flash")
+
+    def test_stt_latency_from_end_of_utterance(self):
+        metrics = EOUMetrics(
+            timestamp=0, end_of_utterance_delay=0.5, transcription_delay=0.3,
+            on_user_turn_completed_delay=0, last_speaking_time=0,
+        )
+        self.stats.collect(metrics, active={"stt": "deepgram/nova-3:en"})
+        self.assertEqual(self.stats.latency("deepgram/nova-3:en"), 0.3)
+
+    def test_voices_of_one_model_are_ranked_apart(self):
+        voices = ["cartesia/sonic-2:voice-a", "cartesia/sonic-2:voice-b"]
+        for _ in range(3):
+            self.stats.record_failure(voices[0])
+        self.assertTrue(self.stats.healthy(voices[1]))
+        self.assertEqual(self.stats.rank(voices), voices[::-1])
+
+    def test_stats_are_shared_through_the_file(self):
+        self.stats.collect(_llm_metrics("openai/gpt-4o-mini", 0.2))
+        self.stats.save()
+        other = ProviderStats(self.path)
+        other.collect(_llm_metrics("openai/gpt-4.1-mini", 0.9))
+        other.save()
+
+        merged = ProviderStats(self.path)
+        self.assertEqual(merged.latency("openai/gpt-4o-mini"), 0.2)
+        self.assertEqual(merged.latency("openai/gpt-4.1-mini"), 0.9)
+
+
+class TestLoadProfiles(unittest.TestCase):
+    def test_stt_models_follow_the_preferred_language(self):
+        for language, suffix in (("fr", ":fr"), ("French", ":fr"), ("en-US", ":en"), (None, ":en")):
+            stt = load_profiles("missing.json", language)["stt"]
+            self.assertTrue(stt and all(model.endswith(suffix) for model in stt), (language, stt))
+
+    @patch.dict(os.environ, {"STT_PROVIDERS": "deepgram/nova-3:fr,assemblyai/universal-streaming:en"})
+    def test_stt_models_of_another_language_are_dropped(self):
+        self.assertEqual(load_profiles("missing.json", "fr")["stt"], ["deepgram/nova-3:fr"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import multiprocessing
+import unittest
+
+import shared_models
+
+
+def _has_preloaded_vad(queue):
+    queue.put(shared_models._vad is not None)
+
+
+class TestSharedModels(unittest.TestCase):
+    def test_vad_is_loaded_once_per_process(self):
+        self.assertIs(shared_models.vad(), shared_models.vad())
+
+    def test_forked_processes_inherit_the_vad(self):
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["shared_models"])
+        queue = context.Queue()
+        process = context.Process(target=_has_preloaded_vad, args=(queue,))
+        process.start()
+        process.join(30)
+        self.assertTrue(queue.get(timeout=5))
+
+    def test_memory_usage(self):
+        usage = shared_models.memory_usage()
+        self.assertGreater(usage["rss"], 0)
+        self.assertLessEqual(usage["uss"], usage["rss"])
+
+
+if __name__ == "__main__":
+    unittest.main()
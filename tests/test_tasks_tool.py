@@ -0,0 +1,101 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import google_tasks_tool
+from google_tasks_tool import delete_task, list_open_tasks, list_tasks, update_task
+
+TASK_LISTS = {"items": [{"id": "L1", "title": "My Tasks"}, {"id": "L2", "title": "Groceries"}]}
+# Pages of tasks by task list and page token
+TASKS = {
+    "L1": {
+        None: {
+            "items": [
+                {"id": "T1", "title": "Call the plumber"},
+                {"id": "T4", "title": "Call mom"},
+                {"id": "T5", "title": "Pay rent", "status": "completed"},
+            ],
+            "nextPageToken": "p2",
+        },
+        "p2": {"items": [{"id": "T6", "title": "Renew passport"}]},
+    },
+    "L2": {None: {"items": [{"id": "T2", "title": "Buy milk"}, {"id": "T3", "title": "Buy bread"}]}},
+}
+
+
+@patch("google_tasks_tool.authenticate_google", MagicMock())
+class TestGoogleTasksTool(unittest.TestCase):
+    def setUp(self):
+        google_tasks_tool.invalidate()
+        patcher = patch("google_tasks_tool.build")
+        self.service = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+        self.service.tasklists().list().execute.return_value = TASK_LISTS
+        self.service.tasks().list.side_effect = lambda tasklist, **kwargs: MagicMock(
+            **{"execute.return_value": TASKS[tasklist][kwargs["pageToken"]]}
+        )
+        self.service.tasks().patch().execute.return_value = {"title": "Buy milk"}
+
+    def test_list_tasks_by_name(self):
+        self.assertEqual(
+            list_tasks("groceries"),
+            "Tasks in list Groceries:\n- Buy milk (T2)\n- Buy bread (T3)\n",
+        )
+
+    def test_update_task_by_name_in_one_call(self):
+        result = update_task(None, "buy milk", completed=True)
+
+        self.assertEqual(result, "Task updated: Buy milk")
+        self.service.tasks().patch.assert_called_with(
+            tasklist="L2", task="T2", body={"status": "completed"}
+        )
+
+    def test_fuzzy_match_and_cache_invalidation(self):
+        list_tasks("My Tasks")
+        self.assertIn(("tasks", "L1", True), google_tasks_tool._cache)
+        self.assertEqual(delete_task("My Taks", "call plumber"), "Task deleted.")
+        self.service.tasks().delete.assert_called_with(tasklist="L1", task="T1")
+        self.assertNotIn(("tasks", "L1", True), google_tasks_tool._cache)
+        # The next lookup asks the API again
+        self.service.tasks().list.reset_mock()
+        delete_task("My Tasks", "call mom")
+        self.service.tasks().list.assert_called_with(
+            tasklist="L1", maxResults=100, pageToken="p2", showCompleted=True
+        )
+
+    def test_unknown_task(self):
+        self.assertEqual(update_task(None, "walk the dog", title="x"), "No task matching 'walk the dog'.")
+
+    def test_close_names_are_not_deleted(self):
+        self.assertEqual(
+            delete_task(None, "call bob"),
+            "Several tasks could match 'call bob': Call mom. Ask the user which one they mean.",
+        )
+        self.assertEqual(
+            delete_task(None, "pay tax"),
+            "Several tasks could match 'pay tax': Pay rent. Ask the user which one they mean.",
+        )
+        self.assertEqual(delete_task(None, "c"), "No task matching 'c'.")
+        self.service.tasks().delete.assert_not_called()
+
+    def test_ambiguous_names_list_the_candidates(self):
+        self.service.tasks().patch.reset_mock()
+        self.assertEqual(
+            update_task(None, "buy", completed=True),
+            "Several tasks could match 'buy': Buy milk, Buy bread. Ask the user which one they mean.",
+        )
+        self.service.tasks().patch.assert_not_called()
+
+    def test_every_page_is_read(self):
+        self.assertEqual(delete_task(None, "renew passport"), "Task deleted.")
+        self.service.tasks().delete.assert_called_with(tasklist="L1", task="T6")
+
+    def test_open_tasks_leave_out_completed_ones(self):
+        list_open_tasks(10)
+        self.service.tasks().list.assert_any_call(
+            tasklist="L1", maxResults=100, pageToken=None, showCompleted=False
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+from livekit.agents.llm import find_function_tools
+
+from agent import Assistant
+from tool_router import ALWAYS_ON, TOOL_GROUPS, ToolRouter, route
+
+
+def test_every_tool_is_routed() -> None:
+    names = {tool.__name__ for tool in find_function_tools(Assistant)}
+    grouped = set(ALWAYS_ON) | {name for tools in TOOL_GROUPS.values() for name in tools}
+    assert names == grouped
+
+
+def test_route() -> None:
+    assert route("Hello, how are you?") == set()
+    assert route("Mark buy milk as done in my groceries list") == {"tasks"}
+    assert route("Mark buy milk as done") == {"tasks"}
+    assert route("I need to buy milk") == {"tasks"}
+    assert route("Did Bob reply?") == {"mail"}
+    assert route("Est-ce que Bob a répondu ?") == {"mail"}
+    assert route("Envoie un courriel à Alice") == {"mail"}
+    assert route("Any meeting tomorrow? And what's the weather?") == {"calendar", "utility"}
+    assert route("Planifie une réunion") == {"calendar"}
+
+
+def test_groups_load_and_expire() -> None:
+    router = ToolRouter(idle_turns=2)
+    assert router.next_turn("hi") is None
+    assert router.next_turn("check my email") == {"mail"}
+    assert router.next_turn("read me the first one") is None
+    assert router.next_turn("ok thanks") is None
+    assert router.next_turn("and the last one?") is None
+    # Mail expired, it is dropped when the next group gets loaded
+    assert router.next_turn("add a task") == {"tasks"}
+
+
+def test_enable() -> None:
+    router = ToolRouter()
+    assert router.enable("calendar") == {"calendar"}
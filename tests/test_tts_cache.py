@@ -0,0 +1,80 @@
+import asyncio
+import tempfile
+import unittest
+
+from livekit import rtc
+
+from tts_cache import MIN_HITS, TTSCache, cached_tts_node
+
+MODEL = "cartesia/sonic-2:voice"
+
+
+def _frames(count, sample_rate=24000):
+    samples = sample_rate // 50
+    return [
+        rtc.AudioFrame(bytes([i]) * samples * 2, sample_rate, 1, samples)
+        for i in range(count)
+    ]
+
+
+async def _text(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _run(cache, chunks, synthesized):
+    calls = []
+
+    async def synthesize(stream):
+        calls.append("".join([chunk async for chunk in stream]))
+        for frame in synthesized:
+            yield frame
+
+    async def play():
+        return [frame async for frame in cached_tts_node(cache, _text(*chunks), synthesize)]
+
+    return asyncio.run(play()), calls
+
+
+class TestTTSCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = TTSCache(MODEL, "en", self.directory)
+
+    def test_stored_audio_is_served_from_disk(self):
+        self.cache.store("Task  deleted.", _frames(3))
+        reopened = TTSCache(MODEL, "en", self.directory)
+        frames = list(reopened.frames("Task deleted."))
+        self.assertEqual(len(frames), 3)
+        self.assertEqual(frames[1].sample_rate, 24000)
+        self.assertEqual(bytes(frames[2].data.cast("B"))[:2], b"\x02\x02")
+
+    def test_entries_are_keyed_by_voice_and_language(self):
+        self.cache.store("Task deleted.", _frames(1))
+        self.assertIsNone(TTSCache("cartesia/sonic-2:other", "en", self.directory).frames("Task deleted."))
+        self.assertIsNone(TTSCache(MODEL, "fr", self.directory).frames("Task deleted."))
+
+    def test_hit_skips_the_tts(self):
+        self.cache.store("Task deleted.", _frames(2))
+        frames, calls = _run(self.cache, ["Task ", "deleted."], _frames(5))
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(calls, [])
+
+    def test_miss_streams_the_whole_text(self):
+        self.cache.store("Task deleted.", _frames(2))
+        frames, calls = _run(self.cache, ["Task ", "deleted ", "for good."], _frames(5))
+        self.assertEqual(len(frames), 5)
+        self.assertEqual(calls, ["Task deleted for good."])
+
+    def test_frequent_utterance_is_learned(self):
+        for _ in range(MIN_HITS + 1):
+            _run(self.cache, ["Done."], _frames(4))
+        self.assertIn("Done.", self.cache)
+        frames, calls = _run(self.cache, ["Done."], _frames(4))
+        self.assertEqual((len(frames), calls), (4, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
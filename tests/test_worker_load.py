@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from livekit.agents import WorkerOptions
+
+import worker_load
+from worker_load import WorkerLoad, idle_processes
+
+
+def _worker(*job_ids):
+    return SimpleNamespace(
+        active_jobs=[SimpleNamespace(job=SimpleNamespace(id=job_id)) for job_id in job_ids]
+    )
+
+
+class TestWorkerLoad(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = patch("worker_load.WORKER_LOAD_DIR", os.path.join(self.directory, "load"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.load = WorkerLoad(os.path.join(self.directory, "stats.json"))
+
+    def test_sessions_bound_the_load(self):
+        with patch("worker_load.MAX_SESSIONS", 2):
+            self.assertGreaterEqual(self.load(_worker("a", "b")), 1.0)
+
+    def test_event_loop_lag_of_jobs_counts(self):
+        # Reports are only read for child processes of the worker
+        with patch("worker_load.psutil.Process") as process:
+            process.return_value.children.return_value = [
+                SimpleNamespace(pid=os.getpid(), memory_info=lambda: SimpleNamespace(rss=1))
+            ]
+            worker_load.report(lag=worker_load.MAX_EVENT_LOOP_LAG * 2)
+            self.assertGreaterEqual(self.load(_worker()), 2.0)
+        worker_load.clear_report()
+
+    def test_arrivals_are_recorded_once(self):
+        self.load(_worker("a"))
+        self.load(_worker("a", "b"))
+        self.load(_worker("b"))
+        self.assertEqual(len(self.load.stats["arrivals"]), 2)
+
+
+class TestIdleProcesses(unittest.TestCase):
+    def test_without_history_one_process_is_kept_warm(self):
+        self.assertEqual(idle_processes({"arrivals": []}), 1)
+
+    @patch("worker_load.MAX_IDLE_PROCESSES", 16)
+    def test_pool_follows_the_peak_arrival_rate(self):
+        now = time.time()
+        # 12 rooms in the busiest minute, each process takes 10 s to warm up
+        stats = {"arrivals": [now - 30] * 12 + [now - 600] * 2, "warmup": 10.0}
+        self.assertEqual(idle_processes(stats), 3)
+
+    @patch("worker_load.MAX_IDLE_PROCESSES", 16)
+    def test_pool_fits_in_memory(self):
+        now = time.time()
+        stats = {"arrivals": [now] * 120, "warmup": 10.0, "process_memory": 1 << 60}
+        self.assertEqual(idle_processes(stats), 1)
+
+    def test_livekit_defaults_are_kept_without_history(self):
+        with patch("worker_load.load_stats", return_value={"arrivals": []}):
+            options = worker_load.worker_options()
+        idle = options["num_idle_processes"]
+        self.assertEqual(idle.dev_default, 0)
+        default = WorkerOptions.__dataclass_fields__["num_idle_processes"].default
+        self.assertEqual(idle.prod_default, max(default.prod_default, 1))
+        self.assertEqual(options["load_threshold"].dev_default, float("inf"))
+        self.assertEqual(options["load_threshold"].prod_default, worker_load.LOAD_THRESHOLD)
+
+
+if __name__ == "__main__":
+    unittest.main()